@@ -1,18 +1,9 @@
-# seed.py
-import os
-import json
-from google.cloud import firestore
-from google.oauth2 import service_account
+# seed.py -- run from the repo root: python -m FirebaseStuff.firestoreDataPopulator
+# Seeds the sample stations through the bulk importer, so re-running it only
+# writes the documents that differ from what is already in Firestore.
+import sys
 
-sa_json = os.environ.get("FIREBASE_SERVICE_ACCOUNT")
-if not sa_json:
-    raise RuntimeError("FIREBASE_SERVICE_ACCOUNT env var is missing")
-
-sa_info = json.loads(sa_json)
-project_id = os.getenv("FIREBASE_PROJECT_ID", sa_info.get("project_id"))
-
-creds = service_account.Credentials.from_service_account_info(sa_info)
-db = firestore.Client(project=project_id, credentials=creds)
+from FirebaseStuff.importer import import_rows, read_dicts
 
 data = [
     {
@@ -54,10 +45,13 @@ data = [
 ]
 
 def main():
-    coll = db.collection("distributori")
-    for d in data:
-        coll.document(str(d["id"])).set(d)
-    print(f"thrown {len(data)} documents into 'distributori' in project '{project_id}'.")
+    if "--backfill-province" in sys.argv:
+        from firestore_layer import backfill_province_keys
+        print(f"provincia_key set on {backfill_province_keys()} documents.")
+        return
+    esito = import_rows(read_dicts(data))
+    print(f"{esito['scritti']} of {len(data)} documents written into 'distributori' "
+          f"({esito['invariati']} unchanged, {esito['errori']} errors).")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
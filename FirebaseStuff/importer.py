@@ -0,0 +1,298 @@
+# importer.py -- run from the repo root:
+#   python -m FirebaseStuff.importer stazioni.csv
+#   python -m FirebaseStuff.importer stazioni.jsonl --checkpoint import.ckpt
+#   python -m FirebaseStuff.importer anagrafica_impianti_attivi.csv --formato mimit --prezzi prezzo_alle_8.csv
+#
+# Streams station rows, diffs each one against the current collection and
+# writes only the documents that actually change, in parallel bulk batches.
+# With --checkpoint, progress is saved after every flushed batch and an
+# interrupted run resumes after the last committed row.
+import os
+import csv
+import sys
+import json
+import argparse
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from firebase_client import get_db
+from firestore_layer import COLL, bulk_write, _normalize
+from province import province_key
+
+FLUSH_ROWS = 5000
+
+# MIMIT open-data fuel names -> our fuels (self-service prices only).
+MIMIT_FUELS = {"benzina": "benzina", "gasolio": "diesel"}
+
+# (line number, station fields or None if unparseable, station id if it
+# could be read even so: --elimina-mancanti must not delete that station).
+Row = Tuple[int, Optional[Dict], Optional[int]]
+
+# Fields a document must have when the importer creates it.
+REQUIRED = ("id", "nome", "provincia", "lat", "lon")
+
+def _sniff(path: str, skip: int = 0) -> str:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for _ in range(skip):
+            f.readline()
+        head = f.readline()
+    return max(";|,\t", key=head.count)
+
+def _num(value) -> Optional[float]:
+    if value is None or str(value).strip() == "":
+        return None
+    return float(str(value).replace(",", "."))
+
+def _station(raw: Dict) -> Tuple[Optional[Dict], Optional[int]]:
+    try:
+        d = _parse_station(raw)
+        return d, d["id"]
+    except (KeyError, TypeError, ValueError):
+        pass
+    try:
+        return None, int(raw["id"])
+    except (KeyError, TypeError, ValueError):
+        return None, None
+
+def _parse_station(raw: Dict) -> Dict:
+    # Keeps only the fields the row provides, so the diff (and the merge
+    # write) never touches data the feed doesn't carry.
+    d = {"id": int(raw["id"])}
+    for key in ("nome", "provincia"):
+        if raw.get(key):
+            d[key] = str(raw[key]).strip()
+    for key in ("lat", "lon", "prezzo_benzina", "prezzo_diesel"):
+        value = _num(raw.get(key))
+        if value is not None:
+            d[key] = value
+    livelli = raw.get("livello_carburante") or {}
+    for fuel in ("benzina", "diesel"):
+        value = _num(livelli.get(fuel, raw.get(f"livello_{fuel}")))
+        if value is not None:
+            d.setdefault("livello_carburante", {})[fuel] = value
+    if "provincia" in d:
+        d["provincia_key"] = province_key(d["provincia"])
+    return d
+
+def read_dicts(items: Iterable[Dict]) -> Iterator[Row]:
+    for n, raw in enumerate(items, 1):
+        yield (n, *_station(raw))
+
+# CSV columns: id,nome,provincia,lat,lon,prezzo_benzina,prezzo_diesel,
+# livello_benzina,livello_diesel (any subset besides id).
+def read_csv(path: str) -> Iterator[Row]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f, delimiter=_sniff(path))
+        for raw in reader:
+            yield (reader.line_num, *_station(raw))
+
+def read_jsonl(path: str) -> Iterator[Row]:
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                raw = json.loads(line)
+            except ValueError:
+                raw = {}
+            yield (n, *_station(raw)) if isinstance(raw, dict) else (n, None, None)
+
+def _mimit_prices(path: str) -> Dict[int, Dict[str, float]]:
+    # Lowest self-service price per station and fuel.
+    out: Dict[int, Dict[str, float]] = {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        f.readline()  # "Estrazione del ..."
+        for raw in csv.DictReader(f, delimiter=_sniff(path, skip=1)):
+            fuel = MIMIT_FUELS.get((raw.get("descCarburante") or "").strip().lower())
+            if fuel is None or str(raw.get("isSelf")).strip() != "1":
+                continue
+            did, price = int(raw["idImpianto"]), _num(raw.get("prezzo"))
+            if price is None:
+                continue
+            slot = out.setdefault(did, {})
+            slot[fuel] = min(price, slot.get(fuel, price))
+    return out
+
+def read_mimit(path: str, prezzi: Optional[str] = None) -> Iterator[Row]:
+    prices = _mimit_prices(prezzi) if prezzi else {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        f.readline()  # "Estrazione del ..."
+        reader = csv.DictReader(f, delimiter=_sniff(path, skip=1))
+        for raw in reader:
+            try:
+                did = int(raw["idImpianto"])
+            except (KeyError, TypeError, ValueError):
+                yield reader.line_num + 1, None, None
+                continue
+            row = {
+                "id": did,
+                "nome": raw.get("Nome Impianto") or raw.get("Gestore"),
+                "provincia": raw.get("Provincia"),
+                "lat": raw.get("Latitudine"),
+                "lon": raw.get("Longitudine"),
+            }
+            for fuel, price in prices.get(did, {}).items():
+                row[f"prezzo_{fuel}"] = price
+            yield (reader.line_num + 1, *_station(row))
+
+class Checkpoint:
+    def __init__(self, path: str, source: str):
+        self.path = path
+        st = os.stat(source)
+        self.identity = {"file": os.path.abspath(source), "size": st.st_size, "mtime": st.st_mtime}
+        self.riga = 0
+        self.visti: Set[int] = set()
+        # Ids whose write failed: retried on resume even though their rows
+        # lie before riga.
+        self.falliti: Set[int] = set()
+        self.totali = {"righe": 0, "scritti": 0, "invariati": 0, "scartati": 0, "senza_id": 0, "errori": 0}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("identity") == self.identity:
+                self.riga = saved["riga"]
+                self.visti = set(saved.get("visti", []))
+                self.falliti = set(saved.get("falliti", []))
+                self.totali.update(saved.get("totali", {}))
+
+    def save(self, riga: int):
+        self.riga = riga
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"identity": self.identity, "riga": riga, "visti": sorted(self.visti),
+                       "falliti": sorted(self.falliti), "totali": self.totali}, f)
+        os.replace(tmp, self.path)
+
+    def done(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def load_current() -> Dict[int, Dict]:
+    # Stored fields as they are, so a missing provincia_key shows up as a
+    # change and gets written.
+    docs = (_normalize(doc, derive_key=False) for doc in get_db().collection(COLL).stream())
+    return {d["id"]: d for d in docs}
+
+def _changes(row: Dict, cur: Optional[Dict]) -> Optional[Dict]:
+    if cur is None:
+        return row
+    data = {}
+    for key, value in row.items():
+        if key == "livello_carburante":
+            for fuel, litri in value.items():
+                if cur.get(key, {}).get(fuel) != litri:
+                    data[f"{key}.{fuel}"] = litri
+        elif cur.get(key) != value:
+            data[key] = value
+    return data or None
+
+def import_rows(rows: Iterable[Row], checkpoint: Optional[Checkpoint] = None, flush_rows: int = FLUSH_ROWS,
+                elimina_mancanti: bool = False, dry_run: bool = False, current: Optional[Dict[int, Dict]] = None) -> Dict:
+    current = load_current() if current is None else current
+    ckpt_riga = checkpoint.riga if checkpoint else 0
+    totali = checkpoint.totali if checkpoint else {"righe": 0, "scritti": 0, "invariati": 0, "scartati": 0, "senza_id": 0, "errori": 0}
+    visti = checkpoint.visti if checkpoint else set()
+    falliti = checkpoint.falliti if checkpoint else set()
+    pending: Dict[int, Tuple[str, Dict]] = {}
+    errori: List[Tuple[int, str]] = []
+    last = ckpt_riga
+
+    def flush(riga: int):
+        # New documents need set(); existing ones get update() so dotted
+        # livello_carburante paths only touch the fuel that changed.
+        if not dry_run:
+            for op in ("set", "update"):
+                writes = {did: data for did, (o, data) in pending.items() if o == op}
+                for did, err in bulk_write(writes, op=op).items():
+                    if err is not None:
+                        errori.append((did, err))
+                        falliti.add(did)
+                        totali["errori"] += 1
+                    else:
+                        falliti.discard(did)
+                        totali["scritti"] += 1
+        else:
+            totali["scritti"] += len(pending)
+        pending.clear()
+        if checkpoint:
+            checkpoint.save(riga)
+
+    for riga, row, did in rows:
+        if riga <= ckpt_riga:
+            if row is None or did not in falliti:
+                continue
+            # Failed in an earlier run: counted there, retried now.
+            totali["errori"] -= 1
+        else:
+            totali["righe"] += 1
+            last = riga
+        if elimina_mancanti and did is not None:
+            visti.add(did)
+        if row is None:
+            totali["scartati"] += 1
+            if did is None:
+                totali["senza_id"] += 1
+            continue
+        cur = current.get(row["id"])
+        if cur is None and not all(k in row for k in REQUIRED):
+            totali["scartati"] += 1
+            continue
+        data = _changes(row, cur)
+        if data is None:
+            totali["invariati"] += 1
+            falliti.discard(row["id"])
+        else:
+            pending[row["id"]] = ("set" if cur is None else "update", data)
+        if len(pending) >= flush_rows:
+            flush(last)  # not riga: a retried row lies before the checkpoint
+    flush(last)
+
+    if elimina_mancanti and totali.get("senza_id"):
+        # Any station could be behind a row without a readable id.
+        totali["eliminati"] = 0
+        totali["eliminazione_annullata"] = True
+    elif elimina_mancanti:
+        gone = {did: None for did in current if did not in visti}
+        totali["eliminati"] = len(gone)
+        if gone and not dry_run:
+            for did, err in bulk_write(gone).items():
+                if err is not None:
+                    errori.append((did, err))
+    return {**totali, "dettaglio_errori": errori}
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="Importa distributori e prezzi in Firestore")
+    ap.add_argument("file")
+    ap.add_argument("--formato", choices=("auto", "csv", "jsonl", "mimit"), default="auto")
+    ap.add_argument("--prezzi", help="file prezzi MIMIT (prezzo_alle_8.csv) da unire all'anagrafica")
+    ap.add_argument("--checkpoint", help="file di checkpoint per riprendere un import interrotto")
+    ap.add_argument("--batch", type=int, default=FLUSH_ROWS, help="righe per flush/checkpoint")
+    ap.add_argument("--elimina-mancanti", action="store_true", help="elimina i distributori assenti dal file")
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args(argv)
+
+    formato = args.formato
+    if formato == "auto":
+        formato = "jsonl" if args.file.endswith((".jsonl", ".ndjson")) else "csv"
+    if formato == "mimit":
+        rows = read_mimit(args.file, args.prezzi)
+    elif formato == "jsonl":
+        rows = read_jsonl(args.file)
+    else:
+        rows = read_csv(args.file)
+
+    checkpoint = Checkpoint(args.checkpoint, args.file) if args.checkpoint else None
+    if checkpoint and checkpoint.riga:
+        print(f"ripresa dalla riga {checkpoint.riga + 1}", file=sys.stderr)
+    esito = import_rows(rows, checkpoint, args.batch, args.elimina_mancanti, args.dry_run)
+    if checkpoint and not esito["dettaglio_errori"]:
+        checkpoint.done()
+    elif checkpoint:
+        print(f"checkpoint mantenuto: rilanciare per ritentare i {len(checkpoint.falliti)} distributori falliti", file=sys.stderr)
+    if esito.get("eliminazione_annullata"):
+        print(f"eliminazione annullata: {esito['senza_id']} righe senza id valido", file=sys.stderr)
+    for did, err in esito["dettaglio_errori"][:20]:
+        print(f"errore distributore {did}: {err}", file=sys.stderr)
+    print(json.dumps({k: v for k, v in esito.items() if k != "dettaglio_errori"}))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import bisect
+from typing import Dict, Iterable, List, Optional, Tuple
+
+FUELS = ("benzina", "diesel")
+
+class _Group:
+    __slots__ = ("count", "litri", "somma_prezzi", "prezzi")
+
+    def __init__(self):
+        self.count = 0
+        self.litri = {f: 0.0 for f in FUELS}
+        self.somma_prezzi = {f: 0.0 for f in FUELS}
+        # (price, id) kept sorted: min/max in O(1), and ordered scans for
+        # cheapest-first queries.
+        self.prezzi: Dict[str, List[Tuple[float, int]]] = {f: [] for f in FUELS}
+
+class ProvinceAggregates:
+    # Station count, litres per fuel and price distribution per province,
+    # maintained incrementally as stations are added/removed.
+
+    def __init__(self):
+        self._groups: Dict[str, _Group] = {}
+
+    @classmethod
+    def build(cls, docs: Iterable[Dict]) -> "ProvinceAggregates":
+        agg = cls()
+        for d in docs:
+            agg.add(d)
+        return agg
+
+    def add(self, d: Dict):
+        g = self._groups.get(d["provincia_key"])
+        if g is None:
+            g = self._groups[d["provincia_key"]] = _Group()
+        g.count += 1
+        for f in FUELS:
+            price = d["prezzo_" + f]
+            g.litri[f] += d["livello_carburante"][f]
+            g.somma_prezzi[f] += price
+            bisect.insort(g.prezzi[f], (price, d["id"]))
+
+    def remove(self, d: Dict):
+        g = self._groups.get(d["provincia_key"])
+        if g is None:
+            return
+        g.count -= 1
+        if g.count <= 0:
+            del self._groups[d["provincia_key"]]
+            return
+        for f in FUELS:
+            entry = (d["prezzo_" + f], d["id"])
+            g.litri[f] -= d["livello_carburante"][f]
+            g.somma_prezzi[f] -= entry[0]
+            prices = g.prezzi[f]
+            i = bisect.bisect_left(prices, entry)
+            if i < len(prices) and prices[i] == entry:
+                del prices[i]
+
+    def keys(self) -> List[str]:
+        return sorted(self._groups)
+
+    def price_order(self, key: str, fuel: str) -> List[Tuple[float, int]]:
+        g = self._groups.get(key)
+        return g.prezzi[fuel] if g is not None else []
+
+    def provincia(self, key: str) -> Dict:
+        g = self._groups.get(key)
+        return _summary([g] if g is not None else [])
+
+    def nazionale(self) -> Dict:
+        return _summary(list(self._groups.values()))
+
+    def tutte(self) -> Dict[str, Dict]:
+        return {key: _summary([self._groups[key]]) for key in self.keys()}
+
+def _summary(groups: List[_Group]) -> Dict:
+    count = sum(g.count for g in groups)
+    prezzi: Dict[str, Dict[str, Optional[float]]] = {}
+    for f in FUELS:
+        if not count:
+            prezzi[f] = {"min": None, "media": None, "max": None}
+            continue
+        prezzi[f] = {
+            "min": min(g.prezzi[f][0][0] for g in groups),
+            "media": round(sum(g.somma_prezzi[f] for g in groups) / count, 3),
+            "max": max(g.prezzi[f][-1][0] for g in groups),
+        }
+    return {
+        "distributori": count,
+        "totali_litri": {f: round(sum(g.litri[f] for g in groups), 3) for f in FUELS},
+        "prezzi": prezzi,
+    }
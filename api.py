@@ -0,0 +1,227 @@
+# Request parsing and response payloads shared by app.py (Flask) and
+# app_async.py (Quart). Framework-free: parsers take the request's args
+# (a werkzeug MultiDict in both) or decoded JSON and raise ValueError with
+# the message for a 400; routes only fetch data and pick the status.
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from eventi import EVENTI_RETRY_MS, Evento, broker, sse
+from esportazione import FORMATI, disponibile, encode
+import firebase_client
+from firestore_layer import cache_stats, read_stats
+import metrics
+from ricerca import Criteri, Risultato, parse_criteri
+import telemetria
+
+MAX_VICINI = 500
+MAX_RISULTATI = 500
+RISULTATI_DEFAULT = 10
+MAX_PAGINA = 1000
+PAGINA_DEFAULT = 100
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+EVENTI_NON_DISPONIBILI = "Eventi non disponibili: replica disattivata (CACHE_ENABLED=0)"
+
+class FormatoNonDisponibile(ValueError):
+    # Known export format whose optional library isn't installed (406).
+    pass
+
+def registra_metriche():
+    # Gauges common to both apps on /metrics.
+    metrics.registry.collector("replica", cache_stats)
+    metrics.registry.collector("letture_dirette", read_stats)
+    metrics.registry.collector("eventi", lambda: broker.stats)
+    metrics.registry.collector("firebase", lambda: firebase_client.stats)
+    metrics.registry.collector("telemetria", lambda: {**telemetria.buffer.stats, "in_coda": telemetria.buffer.pending()})
+
+# --- lista / export -----------------------------------------------------------
+
+def parse_pagina(args) -> Optional[Tuple[int, Optional[int]]]:
+    # (limit, after) for keyset pagination, or None for the whole list.
+    limit = args.get("limit", type=int)
+    after = args.get("after", type=int)
+    if limit is None and after is None:
+        return None
+    limit = PAGINA_DEFAULT if limit is None else limit
+    if not (0 < limit <= MAX_PAGINA):
+        raise ValueError(f"'limit' deve essere tra 1 e {MAX_PAGINA}")
+    return limit, after
+
+def pagina_payload(items: List[Dict], limit: int) -> Dict:
+    return {
+        "distributori": items,
+        "successivo": items[-1]["id"] if len(items) == limit else None,
+    }
+
+def parse_since(args) -> Optional[int]:
+    since = args.get("since", type=int)
+    if since is None and args.get("since"):
+        raise ValueError("'since' deve essere la 'versione' di una risposta precedente")
+    return since
+
+def parse_formato(args) -> str:
+    # ?formato=json (default), msgpack or arrow (columnar, optional deps).
+    formato = args.get("formato", "json")
+    if formato == "json":
+        return formato
+    if formato not in FORMATI:
+        raise ValueError(f"'formato' deve essere uno tra json, {', '.join(FORMATI)}")
+    if not disponibile(formato):
+        raise FormatoNonDisponibile(f"Formato '{formato}' non disponibile su questo server")
+    return formato
+
+def encode_export(formato: str, payload: Dict) -> bytes:
+    meta = {k: v for k, v in payload.items() if k != "modificati"}
+    return encode(formato, meta, payload["modificati"])
+
+# --- letture ------------------------------------------------------------------
+
+TOTALI_VUOTI = {"benzina": 0.0, "diesel": 0.0}
+
+def provincia_payload(provincia: str, items: List[Dict], totali: Dict) -> Dict:
+    return {
+        "provincia": provincia,
+        "distributori": [
+            {
+                "id": d["id"],
+                "nome": d["nome"],
+                "provincia": d["provincia"],
+                "livello_carburante": d["livello_carburante"],
+                "prezzi": {"benzina": d["prezzo_benzina"], "diesel": d["prezzo_diesel"]},
+            } for d in items
+        ],
+        "totali_litri": totali,
+    }
+
+def parse_geo(args) -> Tuple[Optional[Tuple[float, float, float, float]], Optional[int]]:
+    # (bbox, zoom) of /api/distributori/geo.
+    bbox = None
+    raw = args.get("bbox")
+    if raw:
+        try:
+            west, south, east, north = (float(v) for v in raw.split(","))
+        except ValueError:
+            raise ValueError("'bbox' deve essere 'ovest,sud,est,nord'")
+        if west > east or south > north:
+            raise ValueError("'bbox' deve essere 'ovest,sud,est,nord'")
+        bbox = west, south, east, north
+    return bbox, args.get("zoom", type=int)
+
+def geo_payload(stations: List[Dict], clusters: List[Dict]) -> Dict:
+    features = []
+    for d in stations:
+        features.append({
+            "type": "Feature",
+            "properties": {
+                "id": d["id"],
+                "nome": d["nome"],
+                "provincia": d["provincia"],
+                "prezzi": {"benzina": d["prezzo_benzina"], "diesel": d["prezzo_diesel"]},
+                "livello_carburante": d["livello_carburante"],
+            },
+            "geometry": {"type": "Point", "coordinates": [d["lon"], d["lat"]]},
+        })
+    for c in clusters:
+        features.append({
+            "type": "Feature",
+            "properties": {
+                "cluster": True,
+                "count": c["count"],
+                "prezzi_medi": c["prezzi_medi"],
+                "totale_litri": c["totale_litri"],
+            },
+            "geometry": {"type": "Point", "coordinates": [c["lon"], c["lat"]]},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+def parse_vicini(args) -> Tuple[float, float, Optional[int], Optional[float]]:
+    # (lat, lon, k, raggio_km); k defaults to 10 without a radius.
+    lat = args.get("lat", type=float)
+    lon = args.get("lon", type=float)
+    k = args.get("k", type=int)
+    raggio = args.get("raggio_km", type=float)
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("Parametri 'lat' e 'lon' obbligatori e validi")
+    if k is not None and not (0 < k <= MAX_VICINI):
+        raise ValueError(f"'k' deve essere tra 1 e {MAX_VICINI}")
+    if raggio is not None and raggio <= 0:
+        raise ValueError("'raggio_km' deve essere > 0")
+    if k is None and raggio is None:
+        k = 10
+    return lat, lon, k, raggio
+
+def vicini_payload(lat: float, lon: float, items: List[Tuple[float, Dict]]) -> Dict:
+    return {
+        "lat": lat,
+        "lon": lon,
+        "distributori": [{**d, "distanza_km": round(dist, 3)} for dist, d in items],
+    }
+
+def parse_cerca(args) -> Criteri:
+    return parse_criteri(args, RISULTATI_DEFAULT, MAX_RISULTATI)
+
+def cerca_payload(c: Criteri, results: List[Risultato]) -> Dict:
+    return {
+        "ordina": c.ordina,
+        "distributori": [
+            {**d, "distanza_km": round(dist, 3)} if dist is not None else d
+            for dist, d in results
+        ],
+    }
+
+# --- scritture ----------------------------------------------------------------
+
+def _oggetto(payload) -> Dict:
+    # JSON body that must be an object; a missing body counts as empty.
+    if payload is None:
+        return {}
+    if not isinstance(payload, dict):
+        raise ValueError("Il corpo della richiesta deve essere un oggetto JSON")
+    return payload
+
+def parse_prezzi(payload) -> Tuple[Optional[float], Optional[float]]:
+    # (benzina, diesel) of a province price POST; validated by the layer.
+    payload = _oggetto(payload)
+    return payload.get("benzina"), payload.get("diesel")
+
+def esito_provincia(provincia: str, n: int, updated: List[Dict]) -> Tuple[Dict, int]:
+    # (body, status) of a province price POST that found stations.
+    errori = sum(1 for u in updated if "errore" in u)
+    body = {"provincia": provincia, "aggiornati": n, "errori": errori, "dettaglio": updated}
+    if not errori:
+        return body, 200
+    # 502: no write went through; 207: partial, see dettaglio.
+    return body, 502 if n == 0 else 207
+
+def parse_bulk(payload) -> Tuple[Dict[str, Dict], Dict[int, Dict]]:
+    # {"province": {"MI": {"benzina": 1.9}}, "distributori": [{"id": 1, "diesel": 1.8}]}
+    payload = _oggetto(payload)
+    province = payload.get("province") or {}
+    distributori = payload.get("distributori") or []
+    if not isinstance(province, dict) or not isinstance(distributori, list):
+        raise ValueError("Formato non valido: 'province' oggetto, 'distributori' lista")
+    try:
+        return province, {int(d["id"]): d for d in distributori}
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(str(e))
+
+def parse_letture(payload) -> List:
+    # JSON body of /api/telemetria/livelli: a list of readings, bare or
+    # under "letture" (NDJSON goes through telemetria.parse_ndjson).
+    if isinstance(payload, dict):
+        payload = payload.get("letture")
+    if not isinstance(payload, list):
+        raise ValueError("Attesa una lista di letture o NDJSON")
+    return payload
+
+def buffer_pieno() -> Tuple[Dict, int, Dict[str, str]]:
+    # (body, status, headers) when telemetry ingestion pushes back.
+    retry = str(max(1, round(telemetria.buffer.flush_interval)))
+    return {"errore": "Buffer telemetria pieno, riprovare"}, 503, {"Retry-After": retry}
+
+# --- eventi -------------------------------------------------------------------
+
+def eventi_inizio(backlog: List[Evento]) -> Iterator[str]:
+    # Opening of an event stream: reconnect delay, then the replayed events.
+    yield f"retry: {EVENTI_RETRY_MS}\n\n"
+    for ev in backlog:
+        yield sse(ev)
@@ -1,33 +1,86 @@
 from __future__ import annotations
-from flask import Flask, jsonify, request, render_template, abort
+from typing import Dict, Iterable, Iterator, List
+from flask import Flask, Response, jsonify, request, render_template, abort
 
-from firestore_layer import (list_all_ordered, get_by_id, get_by_provincia, geo_all, update_prices_by_province)
+from firestore_layer import (list_all_ordered, iter_all_ordered, list_page, get_by_id, get_by_provincia, get_aggregati, geo_view, get_nearby, cerca, subscribe_events, get_delta, update_prices_by_province, update_prices_bulk, collection_version)
+from eventi import EVENTI_HEARTBEAT_S, EventiPersi, Evento, broker, parse_id, sse
+from esportazione import FORMATI
+from response_cache import cache, cached_body, cached_json
+import api
+import metrics
+import telemetria
 
 
 app = Flask(__name__)
+metrics.init_app(app)
+api.registra_metriche()
+metrics.registry.collector("response_cache", lambda: cache.stats)
+
+STREAM_CHUNK = 64 * 1024
+
+def _json_array(items: Iterable[Dict]) -> Iterator[str]:
+    # Encodes items as a JSON array incrementally, flushing ~STREAM_CHUNK
+    # sized pieces so memory stays flat regardless of collection size.
+    buf, size, sep = ["["], 1, ""
+    for item in items:
+        piece = sep + app.json.dumps(item, separators=(",", ":"))
+        buf.append(piece)
+        size += len(piece)
+        sep = ","
+        if size >= STREAM_CHUNK:
+            yield "".join(buf)
+            buf, size = [], 0
+    buf.append("]\n")
+    yield "".join(buf)
+
+def _parsed(parse, *args):
+    try:
+        return parse(*args)
+    except ValueError as e:
+        abort(400, description=str(e))
 
 @app.get("/api/distributori")
 def api_distributori():
-    return jsonify(list_all_ordered())
+    pagina = _parsed(api.parse_pagina, request.args)
+    if pagina is None:
+        return cached_json("lista", list_all_ordered,
+                           fallback=lambda: Response(_json_array(iter_all_ordered()), mimetype="application/json"))
+    limit, after = pagina
+    return cached_json(f"pagina:{limit}:{after}", lambda: api.pagina_payload(list_page(limit, after), limit))
+
+@app.get("/api/distributori/delta")
+def api_distributori_delta():
+    since = _parsed(api.parse_since, request.args)
+    return _export(f"delta:{since}", lambda: get_delta(since))
+
+@app.get("/api/distributori/snapshot")
+def api_distributori_snapshot():
+    return _export("snapshot", get_delta)
+
+def _export(key: str, build):
+    try:
+        formato = api.parse_formato(request.args)
+    except api.FormatoNonDisponibile as e:
+        abort(406, description=str(e))
+    except ValueError as e:
+        abort(400, description=str(e))
+    if formato == "json":
+        return cached_json(key, build)
+    return cached_body(f"{key}:{formato}", lambda: api.encode_export(formato, build()), FORMATI[formato])
 
 @app.get("/api/distributori/provincia/<provincia>")
 def api_livelli_provincia(provincia: str):
+    return cached_json(f"provincia:{provincia}", lambda: _provincia_payload(provincia))
+
+def _provincia_payload(provincia: str):
     items = get_by_provincia(provincia)
-    tot_b = sum(d["livello_carburante"]["benzina"] for d in items)
-    tot_d = sum(d["livello_carburante"]["diesel"] for d in items)
-    return jsonify({
-        "provincia": provincia,
-        "distributori": [
-            {
-                "id": d["id"],
-                "nome": d["nome"],
-                "provincia": d["provincia"],
-                "livello_carburante": d["livello_carburante"],
-                "prezzi": {"benzina": d["prezzo_benzina"], "diesel": d["prezzo_diesel"]},
-            } for d in items
-        ],
-        "totali_litri": {"benzina": tot_b, "diesel": tot_d},
-    })
+    totali = get_aggregati(provincia, items)["totali_litri"] if items else api.TOTALI_VUOTI
+    return api.provincia_payload(provincia, items, totali)
+
+@app.get("/api/aggregati")
+def api_aggregati():
+    provincia = request.args.get("provincia")
+    return cached_json(f"aggregati:{provincia}", lambda: get_aggregati(provincia))
 
 @app.get("/api/distributori/<int:did>")
 def api_distributore_singolo(did: int):
@@ -38,33 +91,80 @@ def api_distributore_singolo(did: int):
 
 @app.get("/api/distributori/geo")
 def api_distributori_geo():
-    features = []
-    for d in geo_all():
-        features.append({
-            "type": "Feature",
-            "properties": {
-                "id": d["id"],
-                "nome": d["nome"],
-                "provincia": d["provincia"],
-                "prezzi": {"benzina": d["prezzo_benzina"], "diesel": d["prezzo_diesel"]},
-                "livello_carburante": d["livello_carburante"],
-            },
-            "geometry": {"type": "Point", "coordinates": [d["lon"], d["lat"]]},
-        })
-    return jsonify({"type": "FeatureCollection", "features": features})
+    bbox, zoom = _parsed(api.parse_geo, request.args)
+    return cached_json(f"geo:{bbox}:{zoom}", lambda: api.geo_payload(*geo_view(bbox, zoom)))
+
+@app.get("/api/distributori/vicini")
+def api_distributori_vicini():
+    lat, lon, k, raggio = _parsed(api.parse_vicini, request.args)
+    return jsonify(api.vicini_payload(lat, lon, get_nearby(lat, lon, k=k, raggio_km=raggio)))
+
+@app.get("/api/distributori/cerca")
+def api_distributori_cerca():
+    c = _parsed(api.parse_cerca, request.args)
+    return jsonify(api.cerca_payload(c, cerca(c)))
 
 @app.post("/api/prezzi/provincia/<provincia>")
 def api_cambia_prezzi_provincia(provincia: str):
-    payload = request.get_json(silent=True) or {}
-    benz = payload.get("benzina")
-    dies = payload.get("diesel")
-    try:
-        n, updated = update_prices_by_province(provincia, benzina=benz, diesel=dies)
-    except ValueError as e:
-        abort(400, description=str(e))
-    if n == 0:
+    benz, dies = _parsed(api.parse_prezzi, request.get_json(silent=True))
+    n, updated = _parsed(lambda: update_prices_by_province(provincia, benzina=benz, diesel=dies))
+    if not updated:
         abort(404, description="Nessun distributore trovato per la provincia indicata")
-    return jsonify({"provincia": provincia, "aggiornati": n, "dettaglio": updated})
+    body, status = api.esito_provincia(provincia, n, updated)
+    return jsonify(body), status
+
+@app.post("/api/prezzi/bulk")
+def api_cambia_prezzi_bulk():
+    province, per_id = _parsed(api.parse_bulk, request.get_json(silent=True))
+    esito = _parsed(lambda: update_prices_bulk(province=province, distributori=per_id))
+    if not esito["dettaglio"]:
+        abort(404, description="Nessun distributore trovato")
+    return jsonify(esito)
+
+@app.get("/api/eventi")
+def api_eventi():
+    # Server-Sent Events: one "distributore" event per station whose prices
+    # or levels change (only the changed fields), "eliminato" on deletion.
+    # Event ids are "<version>.<station id>" with the version taken from
+    # Firestore's update time, so Last-Event-ID resumes on any worker, also
+    # in the middle of a batch.
+    since = parse_id(request.headers.get("Last-Event-ID")) or parse_id(request.args.get("since"))
+    sub = subscribe_events(since)
+    if sub is None:
+        abort(503, description=api.EVENTI_NON_DISPONIBILI)
+    return Response(_eventi_stream(*sub), mimetype="text/event-stream", headers=api.SSE_HEADERS)
+
+def _eventi_stream(cursor: int, backlog: List[Evento]) -> Iterator[str]:
+    with broker.connessione():
+        yield from api.eventi_inizio(backlog)
+        while True:
+            try:
+                cursor, events = broker.read(cursor, EVENTI_HEARTBEAT_S)
+            except EventiPersi:
+                return  # client reconnects with its Last-Event-ID
+            if not events:
+                collection_version()  # keeps the listener's staleness check running
+                yield ": ping\n\n"
+            for ev in events:
+                yield sse(ev)
+
+@app.post("/api/telemetria/livelli")
+def api_telemetria_livelli():
+    # JSON list of {"id", "benzina", "diesel", "ts"} or one per line (NDJSON).
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        raws = telemetria.parse_ndjson(request.stream)
+    else:
+        raws = _parsed(api.parse_letture, request.get_json(silent=True))
+    try:
+        esito = telemetria.ingest(raws)
+    except telemetria.BufferPieno:
+        body, status, headers = api.buffer_pieno()
+        return jsonify(body), status, headers
+    return jsonify(esito), 202
+
+@app.get("/metrics")
+def api_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 # ------------------------------
 # UI (templates unchanged)
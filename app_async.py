@@ -0,0 +1,174 @@
+# ASGI entry point: same API as app.py, served on an event loop so a single
+# worker keeps many requests in flight while they wait on Firestore.
+# Parsing and payloads come from api.py; there is no response cache here.
+#   hypercorn app_async:app --workers 2 --bind 0.0.0.0:8000
+from __future__ import annotations
+import asyncio
+from typing import AsyncIterator, List
+from quart import Quart, Response, jsonify, request, render_template, abort
+
+import firestore_async as fa
+from eventi import EVENTI_HEARTBEAT_S, EventiPersi, Evento, broker, parse_id, sse
+from esportazione import FORMATI
+import api
+import metrics
+import telemetria
+
+app = Quart(__name__)
+metrics.init_quart_app(app)
+api.registra_metriche()
+
+@app.before_serving
+async def _avvio():
+    await fa.start_replica()
+
+def _parsed(parse, *args):
+    try:
+        return parse(*args)
+    except ValueError as e:
+        abort(400, description=str(e))
+
+@app.get("/api/distributori")
+async def api_distributori():
+    pagina = _parsed(api.parse_pagina, request.args)
+    if pagina is None:
+        return jsonify(await fa.list_all_ordered())
+    limit, after = pagina
+    return jsonify(api.pagina_payload(await fa.list_page(limit, after), limit))
+
+@app.get("/api/distributori/delta")
+async def api_distributori_delta():
+    since = _parsed(api.parse_since, request.args)
+    return await _export(lambda: fa.get_delta(since))
+
+@app.get("/api/distributori/snapshot")
+async def api_distributori_snapshot():
+    return await _export(fa.get_delta)
+
+async def _export(build):
+    try:
+        formato = api.parse_formato(request.args)
+    except api.FormatoNonDisponibile as e:
+        abort(406, description=str(e))
+    except ValueError as e:
+        abort(400, description=str(e))
+    if formato == "json":
+        return jsonify(await build())
+    body = await asyncio.to_thread(api.encode_export, formato, await build())
+    return Response(body, mimetype=FORMATI[formato])
+
+@app.get("/api/distributori/provincia/<provincia>")
+async def api_livelli_provincia(provincia: str):
+    items = await fa.get_by_provincia(provincia)
+    totali = (await fa.get_aggregati(provincia, items))["totali_litri"] if items else api.TOTALI_VUOTI
+    return jsonify(api.provincia_payload(provincia, items, totali))
+
+@app.get("/api/aggregati")
+async def api_aggregati():
+    return jsonify(await fa.get_aggregati(request.args.get("provincia")))
+
+@app.get("/api/distributori/<int:did>")
+async def api_distributore_singolo(did: int):
+    d = await fa.get_by_id(did)
+    if not d:
+        abort(404, description="Distributore non trovato")
+    return jsonify(d)
+
+@app.get("/api/distributori/geo")
+async def api_distributori_geo():
+    bbox, zoom = _parsed(api.parse_geo, request.args)
+    return jsonify(api.geo_payload(*await fa.geo_view(bbox, zoom)))
+
+@app.get("/api/distributori/vicini")
+async def api_distributori_vicini():
+    lat, lon, k, raggio = _parsed(api.parse_vicini, request.args)
+    return jsonify(api.vicini_payload(lat, lon, await fa.get_nearby(lat, lon, k=k, raggio_km=raggio)))
+
+@app.get("/api/distributori/cerca")
+async def api_distributori_cerca():
+    c = _parsed(api.parse_cerca, request.args)
+    return jsonify(api.cerca_payload(c, await fa.cerca(c)))
+
+@app.post("/api/prezzi/provincia/<provincia>")
+async def api_cambia_prezzi_provincia(provincia: str):
+    benz, dies = _parsed(api.parse_prezzi, await request.get_json(silent=True))
+    try:
+        n, updated = await fa.update_prices_by_province(provincia, benzina=benz, diesel=dies)
+    except ValueError as e:
+        abort(400, description=str(e))
+    if not updated:
+        abort(404, description="Nessun distributore trovato per la provincia indicata")
+    body, status = api.esito_provincia(provincia, n, updated)
+    return jsonify(body), status
+
+@app.post("/api/prezzi/bulk")
+async def api_cambia_prezzi_bulk():
+    province, per_id = _parsed(api.parse_bulk, await request.get_json(silent=True))
+    try:
+        esito = await fa.update_prices_bulk(province=province, distributori=per_id)
+    except ValueError as e:
+        abort(400, description=str(e))
+    if not esito["dettaglio"]:
+        abort(404, description="Nessun distributore trovato")
+    return jsonify(esito)
+
+@app.get("/api/eventi")
+async def api_eventi():
+    # Each connection waits on the event loop, not on a thread of its own.
+    since = parse_id(request.headers.get("Last-Event-ID")) or parse_id(request.args.get("since"))
+    sub = await fa.subscribe_events(since)
+    if sub is None:
+        abort(503, description=api.EVENTI_NON_DISPONIBILI)
+    resp = Response(_eventi_stream(*sub), mimetype="text/event-stream", headers=api.SSE_HEADERS)
+    resp.timeout = None  # endless: no response timeout
+    return resp
+
+async def _eventi_stream(cursor: int, backlog: List[Evento]) -> AsyncIterator[str]:
+    with broker.connessione():
+        for chunk in api.eventi_inizio(backlog):
+            yield chunk
+        while True:
+            try:
+                cursor, events = await broker.read_async(cursor, EVENTI_HEARTBEAT_S)
+            except EventiPersi:
+                return  # client reconnects with its Last-Event-ID
+            if not events:
+                await fa.collection_version()  # keeps the listener's staleness check running
+                yield ": ping\n\n"
+            for ev in events:
+                yield sse(ev)
+
+@app.post("/api/telemetria/livelli")
+async def api_telemetria_livelli():
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        raws = list(telemetria.parse_ndjson((await request.get_data()).splitlines()))
+    else:
+        raws = _parsed(api.parse_letture, await request.get_json(silent=True))
+    try:
+        esito = await asyncio.to_thread(telemetria.ingest, raws)
+    except telemetria.BufferPieno:
+        body, status, headers = api.buffer_pieno()
+        return jsonify(body), status, headers
+    return jsonify(esito), 202
+
+@app.get("/metrics")
+async def api_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.get("/")
+async def index():
+    return await render_template("index.html")
+
+@app.get("/distributore/<int:did>")
+async def dettaglio(did: int):
+    d = await fa.get_by_id(did)
+    if not d:
+        abort(404)
+    return await render_template("dettaglio.html", d=d)
+
+@app.get("/mappa")
+async def mappa():
+    return await render_template("mappa.html")
+
+if __name__ == "__main__":
+    app.run(debug=True)
@@ -0,0 +1,292 @@
+# In-memory stand-in for the Firestore client (see firebase_client.set_db),
+# covering the calls this repo makes: documents (get/set/update with dotted
+# paths/delete), batches, get_all, queries (where ==/in, order_by,
+# start_after, limit, stream) and on_snapshot listeners. Optional per-RPC latency simulates the
+# network round trip.
+#
+# Differences from the real service worth knowing when reading numbers:
+# listeners are called synchronously by the writer, and incremental
+# snapshots carry only the changes (the app reads the full document list
+# only from a listener's first snapshot).
+import time, datetime, threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+class NotFound(Exception):
+    pass
+
+class _ChangeType:
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+ADDED, MODIFIED, REMOVED = _ChangeType("ADDED"), _ChangeType("MODIFIED"), _ChangeType("REMOVED")
+
+class DocumentChange:
+    __slots__ = ("type", "document")
+
+    def __init__(self, type_: _ChangeType, document: "DocumentSnapshot"):
+        self.type = type_
+        self.document = document
+
+class DocumentSnapshot:
+    __slots__ = ("id", "_data", "update_time", "reference")
+
+    def __init__(self, reference: "DocumentReference", data: Optional[Dict], update_time):
+        self.id = reference.id
+        self.reference = reference
+        self._data = data  # never mutated: writes replace the stored dict
+        self.update_time = update_time
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[Dict]:
+        if self._data is None:
+            return None
+        return {k: dict(v) if isinstance(v, dict) else v for k, v in self._data.items()}
+
+    def get(self, field: str):
+        value = self._data
+        for part in field.split("."):
+            value = value[part]
+        return value
+
+class WriteResult:
+    __slots__ = ("update_time",)
+
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+class _Watch:
+    def __init__(self, coll: "CollectionReference", callback: Callable):
+        self._coll = coll
+        self.callback = callback
+        self.is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+        with self._coll._db._lock:
+            if self in self._coll._watches:
+                self._coll._watches.remove(self)
+
+class Query:
+    def __init__(self, coll: "CollectionReference", filters=(), order: Optional[str] = None,
+                 after=None, limit: Optional[int] = None):
+        self._coll = coll
+        self._filters = list(filters)
+        self._order = order
+        self._after = after
+        self._limit = limit
+
+    def _copy(self, **kw) -> "Query":
+        args = dict(filters=self._filters, order=self._order, after=self._after, limit=self._limit)
+        args.update(kw)
+        return Query(self._coll, **args)
+
+    def where(self, field: str, op: str, value) -> "Query":
+        if op not in ("==", "in"):
+            raise ValueError(f"operatore non supportato: {op}")
+        return self._copy(filters=self._filters + [(field, op, value)])
+
+    def order_by(self, field: str) -> "Query":
+        return self._copy(order=field)
+
+    def start_after(self, values) -> "Query":
+        return self._copy(after=values)
+
+    def limit(self, n: int) -> "Query":
+        return self._copy(limit=n)
+
+    def _matches(self, data: Dict) -> bool:
+        for field, op, value in self._filters:
+            have = data.get(field)
+            if (op == "==" and have != value) or (op == "in" and have not in value):
+                return False
+        return True
+
+    def stream(self) -> Iterator[DocumentSnapshot]:
+        db = self._coll._db
+        db._rpc()
+        with db._lock:
+            rows = [(did, data, db._times[(self._coll.name, did)])
+                    for did, data in self._coll._docs.items() if self._matches(data)]
+        if self._order is not None:
+            field = self._order
+            rows.sort(key=lambda r: r[1].get(field))
+            if self._after is not None:
+                after = self._after[field] if isinstance(self._after, dict) else self._after.get(field)
+                rows = [r for r in rows if r[1].get(field) > after]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        db.stats["letture"] += max(len(rows), 1)
+        for did, data, ts in rows:
+            yield DocumentSnapshot(self._coll.document(did), data, ts)
+
+    def get(self) -> List[DocumentSnapshot]:
+        return list(self.stream())
+
+class CollectionReference(Query):
+    def __init__(self, db: "FakeFirestore", name: str):
+        self._db = db
+        self.name = name
+        self._docs: Dict[str, Dict] = {}
+        self._watches: List[_Watch] = []
+        super().__init__(self)
+
+    def document(self, did) -> "DocumentReference":
+        return DocumentReference(self, str(did))
+
+    def on_snapshot(self, callback: Callable) -> _Watch:
+        db = self._db
+        with db._lock:
+            watch = _Watch(self, callback)
+            docs = [DocumentSnapshot(self.document(did), data, db._times[(self.name, did)])
+                    for did, data in self._docs.items()]
+            self._watches.append(watch)
+            read_time = db._now()
+        db.stats["letture"] += len(docs)
+        callback(docs, [DocumentChange(ADDED, d) for d in docs], read_time)
+        return watch
+
+class DocumentReference:
+    __slots__ = ("_coll", "id")
+
+    def __init__(self, coll: CollectionReference, did: str):
+        self._coll = coll
+        self.id = did
+
+    def get(self) -> DocumentSnapshot:
+        db = self._coll._db
+        db._rpc()
+        db.stats["letture"] += 1
+        with db._lock:
+            return DocumentSnapshot(self, self._coll._docs.get(self.id), db._times.get((self._coll.name, self.id)))
+
+    def set(self, data: Dict, merge: bool = False) -> WriteResult:
+        batch = self._coll._db.batch()
+        batch.set(self, data, merge=merge)
+        return batch.commit()[0]
+
+    def update(self, data: Dict) -> WriteResult:
+        batch = self._coll._db.batch()
+        batch.update(self, data)
+        return batch.commit()[0]
+
+    def delete(self) -> WriteResult:
+        batch = self._coll._db.batch()
+        batch.delete(self)
+        return batch.commit()[0]
+
+def _apply_update(cur: Dict, data: Dict) -> Dict:
+    new = dict(cur)
+    for path, value in data.items():
+        parts = path.split(".")
+        target = new
+        for part in parts[:-1]:
+            child = dict(target.get(part) or {})
+            target[part] = child
+            target = child
+        target[parts[-1]] = value
+    return new
+
+class WriteBatch:
+    def __init__(self, db: "FakeFirestore"):
+        self._db = db
+        self._ops = []
+
+    def set(self, ref: DocumentReference, data: Dict, merge: bool = False):
+        self._ops.append(("set_merge" if merge else "set", ref, data))
+
+    def update(self, ref: DocumentReference, data: Dict):
+        self._ops.append(("update", ref, data))
+
+    def delete(self, ref: DocumentReference):
+        self._ops.append(("delete", ref, None))
+
+    def commit(self) -> List[WriteResult]:
+        # Atomic like the real thing: a missing document for update() fails
+        # the whole batch before anything is applied.
+        db = self._db
+        db._rpc()
+        changes: Dict[str, List[DocumentChange]] = {}
+        results = []
+        with db._lock:
+            for op, ref, _ in self._ops:
+                if op == "update" and ref.id not in ref._coll._docs:
+                    raise NotFound(f"No document to update: {ref._coll.name}/{ref.id}")
+            ts = db._now()
+            for op, ref, data in self._ops:
+                docs = ref._coll._docs
+                cur = docs.get(ref.id)
+                if op == "delete":
+                    if cur is not None:
+                        del docs[ref.id]
+                        snap = DocumentSnapshot(ref, cur, db._times.pop((ref._coll.name, ref.id)))
+                        changes.setdefault(ref._coll.name, []).append(DocumentChange(REMOVED, snap))
+                    results.append(WriteResult(ts))
+                    continue
+                if op == "set" or cur is None:
+                    new = _apply_update({}, data) if op == "set_merge" else dict(data)
+                else:
+                    new = _apply_update(cur, data)
+                docs[ref.id] = new
+                db._times[(ref._coll.name, ref.id)] = ts
+                changes.setdefault(ref._coll.name, []).append(
+                    DocumentChange(ADDED if cur is None else MODIFIED, DocumentSnapshot(ref, new, ts)))
+                results.append(WriteResult(ts))
+            db.stats["scritture"] += len(self._ops)
+            watches = [(w, changes[name]) for name, coll in db._collections.items() if name in changes
+                       for w in list(coll._watches)]
+        for watch, chs in watches:
+            if watch.is_active:
+                watch.callback([], chs, ts)
+        return results
+
+class FakeFirestore:
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_s = latency_ms / 1000.0
+        self._lock = threading.RLock()
+        self._collections: Dict[str, CollectionReference] = {}
+        self._times: Dict[tuple, datetime.datetime] = {}
+        self._last_us = 0
+        self.stats = {"rpc": 0, "letture": 0, "scritture": 0}
+
+    def _rpc(self):
+        self.stats["rpc"] += 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+
+    def _now(self) -> datetime.datetime:
+        # Strictly increasing commit timestamps, like Firestore's.
+        us = max(time.time_ns() // 1000, self._last_us + 1)
+        self._last_us = us
+        return datetime.datetime.fromtimestamp(us / 1e6, tz=datetime.timezone.utc).replace(microsecond=us % 1_000_000)
+
+    def collection(self, name: str) -> CollectionReference:
+        with self._lock:
+            coll = self._collections.get(name)
+            if coll is None:
+                coll = self._collections[name] = CollectionReference(self, name)
+            return coll
+
+    def batch(self) -> WriteBatch:
+        return WriteBatch(self)
+
+    def get_all(self, refs: Iterable[DocumentReference]) -> Iterator[DocumentSnapshot]:
+        refs = list(refs)
+        self._rpc()
+        self.stats["letture"] += len(refs)
+        with self._lock:
+            snaps = [DocumentSnapshot(r, r._coll._docs.get(r.id), self._times.get((r._coll.name, r.id))) for r in refs]
+        return iter(snaps)
+
+    def load(self, collection: str, docs: Iterable[Dict]):
+        # Bulk seeding, without RPC cost or listener notifications.
+        coll = self.collection(collection)
+        with self._lock:
+            ts = self._now()
+            for d in docs:
+                coll._docs[str(d["id"])] = d
+                self._times[(collection, str(d["id"]))] = ts
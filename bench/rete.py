@@ -0,0 +1,32 @@
+# Synthetic station networks for the benchmarks: deterministic for a given
+# size and seed, spread over every province with a centre per province so
+# density looks like a real network (dense around cities, sparse between).
+import random
+from typing import Dict, List
+
+from province import PROVINCE
+
+# Rough bounding box of Italy.
+LAT_MIN, LAT_MAX = 36.7, 46.9
+LON_MIN, LON_MAX = 6.7, 18.4
+
+def genera(n: int, seed: int = 42) -> List[Dict]:
+    rnd = random.Random(seed)
+    sigle = sorted(PROVINCE)
+    centri = {s: (rnd.uniform(LAT_MIN, LAT_MAX), rnd.uniform(LON_MIN, LON_MAX)) for s in sigle}
+    out = []
+    for did in range(1, n + 1):
+        sigla = sigle[rnd.randrange(len(sigle))]
+        lat0, lon0 = centri[sigla]
+        out.append({
+            "id": did,
+            "nome": f"Iperstaroil {PROVINCE[sigla]} {did}",
+            "provincia": sigla,
+            "provincia_key": sigla,
+            "lat": round(min(max(rnd.gauss(lat0, 0.25), LAT_MIN), LAT_MAX), 6),
+            "lon": round(min(max(rnd.gauss(lon0, 0.25), LON_MIN), LON_MAX), 6),
+            "livello_carburante": {"benzina": float(rnd.randrange(0, 20000)), "diesel": float(rnd.randrange(0, 20000))},
+            "prezzo_benzina": round(rnd.uniform(1.75, 2.05), 3),
+            "prezzo_diesel": round(rnd.uniform(1.65, 1.95), 3),
+        })
+    return out
@@ -0,0 +1,273 @@
+# Benchmark / load test of app.py against the in-memory Firestore stand-in
+# (bench/fakefirestore.py) filled with a synthetic network.
+#
+#   python -m bench.run --stazioni 1000,10000,100000 --durata 5 --concorrenza 8
+#   python -m bench.run --baseline bench/baseline.json --salva-baseline
+#   python -m bench.run --baseline bench/baseline.json   # exit 1 on regression
+#
+# Each network size runs in its own child process (fresh replica, caches
+# and metrics). Requests go through Flask's test client, one per thread, so
+# numbers cover the app, not a WSGI server or the network; --latenza-ms adds
+# a simulated round trip to every Firestore RPC. Results are JSON on stdout.
+# The SSE scenario opens a stream and reads up to its first heartbeat, sent
+# every EVENTI_HEARTBEAT_S (0.01 s here unless set), then disconnects.
+import os, sys, json, time, random, argparse, platform, threading, subprocess, tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+from bench import rete
+from bench.fakefirestore import FakeFirestore
+import firebase_client
+from province import PROVINCE
+
+# name -> (method, expected status, request builder(rnd, n) -> (path, kwargs))
+Builder = Callable[[random.Random, int], Tuple[str, Dict]]
+
+def _bbox(rnd: random.Random, span: float) -> str:
+    lat = rnd.uniform(rete.LAT_MIN, rete.LAT_MAX - span)
+    lon = rnd.uniform(rete.LON_MIN, rete.LON_MAX - span)
+    return f"{lon:.4f},{lat:.4f},{lon + span:.4f},{lat + span:.4f}"
+
+def _punto(rnd: random.Random) -> str:
+    return f"lat={rnd.uniform(rete.LAT_MIN, rete.LAT_MAX):.5f}&lon={rnd.uniform(rete.LON_MIN, rete.LON_MAX):.5f}"
+
+_SIGLE = sorted(PROVINCE)
+
+def _sigla(rnd: random.Random) -> str:
+    return rnd.choice(_SIGLE)
+
+def _prezzo(rnd: random.Random) -> float:
+    return round(rnd.uniform(1.6, 2.1), 3)
+
+SCENARI: Dict[str, Tuple[str, int, Builder]] = {
+    "lista": ("GET", 200, lambda rnd, n: ("/api/distributori", {})),
+    "pagina": ("GET", 200, lambda rnd, n: (f"/api/distributori?limit=100&after={rnd.randrange(n)}", {})),
+    "singolo": ("GET", 200, lambda rnd, n: (f"/api/distributori/{rnd.randint(1, n)}", {})),
+    "mancante": ("GET", 404, lambda rnd, n: (f"/api/distributori/{n + rnd.randint(1, 1000)}", {})),
+    "provincia": ("GET", 200, lambda rnd, n: (f"/api/distributori/provincia/{_sigla(rnd)}", {})),
+    "aggregati": ("GET", 200, lambda rnd, n: ("/api/aggregati", {})),
+    "geo_cluster": ("GET", 200, lambda rnd, n: (f"/api/distributori/geo?bbox={_bbox(rnd, 4.0)}&zoom=7", {})),
+    "geo_dettaglio": ("GET", 200, lambda rnd, n: (f"/api/distributori/geo?bbox={_bbox(rnd, 0.1)}&zoom=15", {})),
+    "vicini": ("GET", 200, lambda rnd, n: (f"/api/distributori/vicini?{_punto(rnd)}&k=10", {})),
+    "cerca_prezzo": ("GET", 200, lambda rnd, n: ("/api/distributori/cerca?ordina=prezzo_diesel&livello_min_diesel=5000&prezzo_max_diesel=1.9", {})),
+    "cerca_raggio": ("GET", 200, lambda rnd, n: (f"/api/distributori/cerca?{_punto(rnd)}&raggio_km=25&ordina=prezzo_benzina", {})),
+    "delta": ("GET", 200, lambda rnd, n: ("/api/distributori/delta?since=0", {})),
+    "snapshot_msgpack": ("GET", 200, lambda rnd, n: ("/api/distributori/snapshot?formato=msgpack", {})),
+    "index_html": ("GET", 200, lambda rnd, n: ("/", {})),
+    "mappa_html": ("GET", 200, lambda rnd, n: ("/mappa", {})),
+    "dettaglio_html": ("GET", 200, lambda rnd, n: (f"/distributore/{rnd.randint(1, n)}", {})),
+    "eventi": ("GET", 200, lambda rnd, n: ("/api/eventi", {})),
+    "metrics": ("GET", 200, lambda rnd, n: ("/metrics", {})),
+    # Writes last: they bump the collection version and invalidate the
+    # response cache for the scenarios above.
+    "prezzi_provincia": ("POST", 200, lambda rnd, n: (
+        f"/api/prezzi/provincia/{_sigla(rnd)}", {"json": {"benzina": _prezzo(rnd), "diesel": _prezzo(rnd)}})),
+    "prezzi_bulk": ("POST", 200, lambda rnd, n: ("/api/prezzi/bulk", {"json": {
+        "distributori": [{"id": rnd.randint(1, n), "benzina": _prezzo(rnd)} for _ in range(50)]}})),
+    "telemetria": ("POST", 202, lambda rnd, n: ("/api/telemetria/livelli", {"json": [
+        {"id": rnd.randint(1, n), "benzina": float(rnd.randrange(20000)), "ts": time.time()} for _ in range(100)]})),
+}
+
+# --- child: one network size ------------------------------------------------
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def _leggi(resp):
+    # Drains the body. An event stream never ends: it is read up to the
+    # first event or heartbeat after the retry line, and closed by the caller.
+    if resp.mimetype != "text/event-stream":
+        resp.get_data()
+        return
+    for chunk in resp.response:
+        if not chunk.startswith(b"retry:"):
+            break
+
+def _carico(app, n: int, builder: Builder, method: str, atteso: int, durata: float, concorrenza: int, seed: int) -> Dict:
+    # One untimed request first: response-cache builds and lazy indexes
+    # would otherwise dominate short runs on large networks.
+    path, kwargs = builder(random.Random(seed), n)
+    app.test_client().open(path, method=method, **kwargs).close()
+    latenze: List[List[float]] = [[] for _ in range(concorrenza)]
+    errori = [0] * concorrenza
+    stop = time.perf_counter() + durata
+
+    def worker(i: int):
+        rnd = random.Random(seed * 1000 + i)
+        client = app.test_client()
+        mine = latenze[i]
+        while time.perf_counter() < stop:
+            path, kwargs = builder(rnd, n)
+            t = time.perf_counter()
+            resp = client.open(path, method=method, **kwargs)
+            _leggi(resp)  # drains streamed bodies too
+            mine.append(time.perf_counter() - t)
+            if resp.status_code != atteso:
+                errori[i] += 1
+            resp.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concorrenza)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    spent = time.perf_counter() - start
+    tutte = sorted(x for xs in latenze for x in xs)
+    return {
+        "richieste": len(tutte),
+        "errori": sum(errori),
+        "rps": round(len(tutte) / spent, 1),
+        "p50_ms": round(_percentile(tutte, 0.50) * 1000, 3),
+        "p99_ms": round(_percentile(tutte, 0.99) * 1000, 3),
+    }
+
+def _allocazioni(app, n: int, builder: Builder, method: str, campioni: int, seed: int) -> Dict:
+    # Single-threaded pass under tracemalloc: peak memory held while
+    # serving one request (median over the samples), and blocks still
+    # allocated afterwards (caches filling up show here).
+    rnd = random.Random(seed)
+    client = app.test_client()
+    picchi = []
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        for _ in range(campioni):
+            path, kwargs = builder(rnd, n)
+            tracemalloc.reset_peak()
+            cur = tracemalloc.get_traced_memory()[0]
+            resp = client.open(path, method=method, **kwargs)
+            _leggi(resp)
+            resp.close()
+            picchi.append(tracemalloc.get_traced_memory()[1] - cur)
+        residuo = tracemalloc.get_traced_memory()[0] - base
+    finally:
+        tracemalloc.stop()
+    picchi.sort()
+    return {"picco_kb": round(_percentile(picchi, 0.5) / 1024, 1), "residuo_kb": round(residuo / 1024, 1)}
+
+def figlio(args) -> Dict:
+    n = args.figlio
+    if args.senza_replica:
+        os.environ["CACHE_ENABLED"] = "0"
+    os.environ.setdefault("EVENTI_HEARTBEAT_S", "0.01")
+    db = FakeFirestore(latency_ms=args.latenza_ms)
+    firebase_client.set_db(db)
+    db.load("distributori", rete.genera(n, args.seed))
+
+    t = time.perf_counter()
+    import app as app_module
+    import firestore_layer
+    import_s = time.perf_counter() - t
+    t = time.perf_counter()
+    firestore_layer.collection_version()  # starts the listener; the fake syncs inline
+    sync_s = time.perf_counter() - t
+
+    app = app_module.app
+    scelti = [s for s in SCENARI if not args.scenari or s in args.scenari]
+    scenari = {}
+    for i, name in enumerate(scelti):
+        method, atteso, builder = SCENARI[name]
+        before = dict(db.stats)
+        res = _carico(app, n, builder, method, atteso, args.durata, args.concorrenza, args.seed + i)
+        res["rpc_firestore"] = db.stats["rpc"] - before["rpc"]
+        res.update(_allocazioni(app, n, builder, method, args.campioni, args.seed + i))
+        scenari[name] = res
+    return {
+        "import_s": round(import_s, 3),
+        "sync_s": round(sync_s, 3),
+        "firestore": dict(db.stats),
+        "scenari": scenari,
+    }
+
+# --- parent: sizes, baseline ------------------------------------------------
+
+# metric -> True if higher is better
+METRICHE = {"rps": True, "p50_ms": False, "p99_ms": False, "picco_kb": False}
+
+def confronta(risultati: Dict, baseline: Dict, tolleranza: float) -> List[str]:
+    regressioni = []
+    for size, res in risultati.items():
+        base = baseline.get("risultati", {}).get(size)
+        if base is None:
+            continue
+        for name, cur in res["scenari"].items():
+            ref = base["scenari"].get(name)
+            if ref is None:
+                continue
+            if cur["errori"] > ref.get("errori", 0):
+                regressioni.append(f"{size} {name}: errori {ref.get('errori', 0)} -> {cur['errori']}")
+            for metric, higher_better in METRICHE.items():
+                old, new = ref.get(metric), cur.get(metric)
+                if not old or new is None:
+                    continue
+                worse = new < old * (1 - tolleranza) if higher_better else new > old * (1 + tolleranza)
+                if worse:
+                    regressioni.append(f"{size} {name}: {metric} {old} -> {new}")
+    return regressioni
+
+def _parse_args(argv: Optional[List[str]] = None):
+    p = argparse.ArgumentParser(prog="python -m bench.run", description="Benchmark di app.py su un Firestore in memoria")
+    p.add_argument("--stazioni", default="1000,10000,100000", help="dimensioni della rete, separate da virgola")
+    p.add_argument("--durata", type=float, default=3.0, help="secondi di carico per scenario")
+    p.add_argument("--concorrenza", type=int, default=8, help="thread client concorrenti")
+    p.add_argument("--latenza-ms", type=float, default=0.0, help="latenza simulata per RPC Firestore")
+    p.add_argument("--campioni", type=int, default=20, help="richieste per la misura delle allocazioni")
+    p.add_argument("--scenari", type=lambda s: s.split(","), default=None, help="solo questi scenari")
+    p.add_argument("--senza-replica", action="store_true", help="CACHE_ENABLED=0: letture dirette")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--baseline", help="file JSON di riferimento")
+    p.add_argument("--salva-baseline", action="store_true", help="scrive i risultati in --baseline")
+    p.add_argument("--tolleranza", type=float, default=0.25, help="peggioramento relativo tollerato")
+    p.add_argument("--figlio", type=int, help=argparse.SUPPRESS)
+    return p.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _parse_args(argv)
+    if args.figlio is not None:
+        json.dump(figlio(args), sys.stdout)
+        return 0
+
+    meta = {
+        "python": platform.python_version(),
+        "durata": args.durata,
+        "concorrenza": args.concorrenza,
+        "latenza_ms": args.latenza_ms,
+        "senza_replica": args.senza_replica,
+    }
+    risultati = {}
+    for size in (int(s) for s in args.stazioni.split(",")):
+        cmd = [sys.executable, "-m", "bench.run", "--figlio", str(size)]
+        for flag in ("durata", "concorrenza", "latenza_ms", "campioni", "seed"):
+            cmd += [f"--{flag.replace('_', '-')}", str(getattr(args, flag))]
+        if args.scenari:
+            cmd += ["--scenari", ",".join(args.scenari)]
+        if args.senza_replica:
+            cmd.append("--senza-replica")
+        print(f"rete da {size} stazioni...", file=sys.stderr)
+        out = subprocess.run(cmd, stdout=subprocess.PIPE, check=True)
+        risultati[str(size)] = json.loads(out.stdout)
+
+    report = {"meta": meta, "risultati": risultati}
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+    if not args.baseline:
+        return 0
+    if args.salva_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline salvata in {args.baseline}", file=sys.stderr)
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("meta") != meta:
+        print(f"attenzione: baseline misurata con {baseline.get('meta')}", file=sys.stderr)
+    regressioni = confronta(risultati, baseline, args.tolleranza)
+    for r in regressioni:
+        print(f"REGRESSIONE {r}", file=sys.stderr)
+    return 1 if regressioni else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import json
+from typing import Dict, Iterable, List
+
+try:
+    import msgpack
+except ImportError:  # optional: msgpack export disabled
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional: Arrow export disabled
+    pa = None
+
+# formato -> mimetype of the binary exports.
+FORMATI = {
+    "msgpack": "application/vnd.msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# Columns of an export: one array per field instead of one map per station,
+# so field names are written once and values pack tightly.
+COLONNE = (
+    ("id", "int64"),
+    ("nome", "string"),
+    ("provincia", "string"),
+    ("provincia_key", "string"),
+    ("lat", "float64"),
+    ("lon", "float64"),
+    ("prezzo_benzina", "float64"),
+    ("prezzo_diesel", "float64"),
+    ("livello_benzina", "float64"),
+    ("livello_diesel", "float64"),
+)
+
+def disponibile(formato: str) -> bool:
+    return {"msgpack": msgpack, "arrow": pa}.get(formato) is not None
+
+def colonne(docs: Iterable[Dict]) -> Dict[str, List]:
+    cols: Dict[str, List] = {name: [] for name, _ in COLONNE}
+    for d in docs:
+        for name, _ in COLONNE:
+            if name.startswith("livello_"):
+                cols[name].append(d["livello_carburante"][name[len("livello_"):]])
+            else:
+                cols[name].append(d.get(name))
+    return cols
+
+def encode(formato: str, meta: Dict, docs: Iterable[Dict]) -> bytes:
+    # meta: versione/completo/eliminati. msgpack carries it next to the
+    # columns; Arrow keeps it as JSON in the schema metadata.
+    cols = colonne(docs)
+    if formato == "msgpack":
+        return msgpack.packb({**meta, "colonne": cols}, use_bin_type=True)
+    schema = pa.schema([(name, getattr(pa, kind)()) for name, kind in COLONNE],
+                       metadata={"iperstaroil": json.dumps(meta)})
+    table = pa.Table.from_pydict(cols, schema=schema)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
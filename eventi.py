@@ -0,0 +1,135 @@
+import os, json, asyncio, threading
+from collections import deque
+from contextlib import contextmanager
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+
+# Recent events kept for Last-Event-ID resume and for subscribers that fall
+# briefly behind.
+EVENTI_BUFFER = int(os.environ.get("EVENTI_BUFFER", "4096"))
+EVENTI_HEARTBEAT_S = float(os.environ.get("EVENTI_HEARTBEAT_S", "15"))
+EVENTI_RETRY_MS = 3000
+
+Evento = Tuple[int, str, Dict]  # (version, event name, payload with the station "id")
+# Resume point from a Last-Event-ID: (version, station id), or (version,
+# None) for "everything after that version" (?since=<versione>).
+Posizione = Tuple[int, Optional[int]]
+
+def event_id(event: Evento) -> str:
+    # Unique: a station is written at most once per commit timestamp, and
+    # the same on every worker (versions are Firestore's update times).
+    return f"{event[0]}.{event[2]['id']}"
+
+def parse_id(raw: Optional[str]) -> Optional[Posizione]:
+    if not raw:
+        return None
+    version, _, did = raw.partition(".")
+    try:
+        return int(version), (int(did) if did else None)
+    except ValueError:
+        return None
+
+def dopo(event: Evento, since: Posizione) -> bool:
+    # Events to replay after `since`. Within one commit the order events
+    # were sent in isn't known here, so its other stations are sent again
+    # (payloads are current values: repeating one is harmless).
+    version, did = since
+    if did is None:
+        return event[0] > version
+    return event[0] > version or (event[0] == version and event[2]["id"] != did)
+
+class EventiPersi(Exception):
+    # The subscriber fell behind the buffer; it should reconnect and resume
+    # from its Last-Event-ID.
+    pass
+
+class Broker:
+    # Fan-out of replica changes to every SSE connection of the process.
+    # Events go into one shared ring; subscribers only hold a cursor into
+    # it, so publishing costs the same with one dashboard or a thousand.
+
+    def __init__(self, size: int = EVENTI_BUFFER):
+        self._cond = threading.Condition()
+        self._log: "deque[Tuple[int, Evento]]" = deque(maxlen=size)
+        self._seq = 0
+        # The ring holds every event newer than this version; None until
+        # the replica has synced.
+        self._covered_from: Optional[int] = None
+        # (loop, asyncio.Event) of the streams waiting in read_async.
+        self._waiters: set = set()
+        self.stats = {"pubblicati": 0, "abbonati": 0, "persi": 0}
+
+    def publish(self, version: int, name: str, payload: Dict):
+        with self._cond:
+            if len(self._log) == self._log.maxlen:
+                self._covered_from = max(self._covered_from or 0, self._log[0][1][0])
+            self._seq += 1
+            self._log.append((self._seq, (version, name, payload)))
+            self.stats["pubblicati"] += 1
+            self._cond.notify_all()
+            for loop, ready in self._waiters:
+                loop.call_soon_threadsafe(ready.set)
+
+    def reset(self, version: int):
+        # Replica (re)built from scratch: history before it is unknown.
+        with self._cond:
+            self._log.clear()
+            self._covered_from = version
+
+    def subscribe(self, since: Optional[Posizione]) -> Tuple[int, Optional[List[Evento]]]:
+        # Returns the cursor for live events plus the events after `since`
+        # still in the ring, or None if the ring doesn't reach back that far.
+        with self._cond:
+            if since is None:
+                return self._seq, []
+            # A resume inside a commit needs that commit's events too.
+            oldest = since[0] if since[1] is None else since[0] - 1
+            if self._covered_from is None or oldest < self._covered_from:
+                return self._seq, None
+            return self._seq, [ev for _, ev in self._log if dopo(ev, since)]
+
+    @contextmanager
+    def connessione(self):
+        # Brackets one streaming response, for the subscriber count.
+        with self._cond:
+            self.stats["abbonati"] += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.stats["abbonati"] -= 1
+
+    def read(self, cursor: int, timeout: float) -> Tuple[int, List[Evento]]:
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > cursor, timeout)
+            if self._seq == cursor:
+                return cursor, []
+            first = self._log[0][0] if self._log else self._seq + 1
+            if cursor + 1 < first:
+                self.stats["persi"] += 1
+                raise EventiPersi()
+            return self._seq, [ev for _, ev in islice(self._log, cursor + 1 - first, None)]
+
+    async def read_async(self, cursor: int, timeout: float) -> Tuple[int, List[Evento]]:
+        # read() for the ASGI streams: waits on the event loop instead of
+        # holding a thread per connection.
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            idle = self._seq == cursor
+            if idle:
+                self._waiters.add(waiter)
+        if idle:
+            try:
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._cond:
+                    self._waiters.discard(waiter)
+        return self.read(cursor, 0)
+
+broker = Broker()
+
+def sse(event: Evento) -> str:
+    _, name, payload = event
+    return f"id: {event_id(event)}\nevent: {name}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
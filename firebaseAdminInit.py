@@ -1,45 +1,11 @@
 # firebase_admin_init.py
-import os, json, firebase_admin
-from firebase_admin import credentials, firestore as admin_firestore
-
-def _init_app_from_env():
-    if firebase_admin._apps:
-        return firebase_admin.get_app()
-
-    sa_json = os.environ.get("FIREBASE_SERVICE_ACCOUNT")
-    if not sa_json:
-        raise RuntimeError(
-            "FIREBASE_SERVICE_ACCOUNT is missing. "
-            "Set it to the FULL JSON of your Firebase service account."
-        )
-
-    sa_info = json.loads(sa_json)
-    cred = credentials.Certificate(sa_info)
-    return firebase_admin.initialize_app(cred)
-
-firebase_app = _init_app_from_env()
-
-db = admin_firestore.client(app=firebase_app)
-
-import os, json, firebase_admin
-from firebase_admin import credentials, firestore as admin_firestore
-
-def _init_app_from_env():
-    if firebase_admin._apps:
-        return firebase_admin.get_app()
-
-    sa_json = os.environ.get("FIREBASE_SERVICE_ACCOUNT")
-    if not sa_json:
-        raise RuntimeError(
-            "FIREBASE_SERVICE_ACCOUNT is missing. "
-            "Set it to the FULL JSON of your Firebase service account."
-        )
-
-    sa_info = json.loads(sa_json)
-
-    cred = credentials.Certificate(sa_info)
-    return firebase_admin.initialize_app(cred)
-
-firebase_app = _init_app_from_env()
-
-db = admin_firestore.client(app=firebase_app)
+# Kept for existing imports: `db` and `firebase_app` now come from
+# firebase_client and are only created when first accessed.
+import firebase_client
+
+def __getattr__(name):
+    if name == "db":
+        return firebase_client.get_db()
+    if name == "firebase_app":
+        return firebase_client.get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,17 +1,12 @@
-import os, json, firebase_admin
-from firebase_admin import credentials, auth
-from google.cloud import firestore
-from google.oauth2 import service_account
+# Kept for existing imports: `db`, `sa_info` and the firebase_admin app
+# (for auth) come from firebase_client, created on first access.
+import firebase_client
 
-sa_info = json.loads(os.environ["FIREBASE_SERVICE_ACCOUNT"])
-
-admin_cred = credentials.Certificate(sa_info)
-firebase_admin.initialize_app(admin_cred, {
-    "projectId": os.getenv("FIREBASE_PROJECT_ID", sa_info.get("project_id"))
-})
-
-gcreds = service_account.Credentials.from_service_account_info(sa_info)
-db = firestore.Client(
-    project=os.getenv("FIREBASE_PROJECT_ID", sa_info.get("project_id")),
-    credentials=gcreds
-)
\ No newline at end of file
+def __getattr__(name):
+    if name == "db":
+        return firebase_client.get_db()
+    if name == "sa_info":
+        return firebase_client.service_account_info()
+    if name == "firebase_app":
+        return firebase_client.get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
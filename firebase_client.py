@@ -0,0 +1,118 @@
+# Firebase app and Firestore clients, created on first use in each process
+# rather than at import time: importing app.py no longer pays for the SDK,
+# credentials and gRPC channel, and a channel opened before gunicorn forks
+# is never shared with (or reused by) the workers.
+import os, json, time, asyncio, threading
+from typing import Any, Callable, Dict, Optional
+
+# Opens the channel (and starts the replica) right after a worker boots,
+# in the background, instead of on its first request. See gunicorn.conf.py.
+FIREBASE_WARMUP = os.environ.get("FIREBASE_WARMUP", "0") != "0"
+
+# Startup timings of this process (seconds), exported on /metrics.
+stats = {
+    "import_sdk_s": 0.0,
+    "client_s": 0.0,
+    "warmup_s": 0.0,
+    "clienti_creati": 0,
+    "fork_rilevati": 0,
+    "warmup_errori": 0,
+}
+
+_lock = threading.Lock()
+_pid: Optional[int] = None
+_client = None
+_override = None
+_async: Optional[tuple] = None  # (pid, loop, AsyncClient)
+
+def service_account_info() -> Dict:
+    sa_json = os.environ.get("FIREBASE_SERVICE_ACCOUNT")
+    if not sa_json:
+        raise RuntimeError(
+            "FIREBASE_SERVICE_ACCOUNT is missing. "
+            "Set it to the FULL JSON of your Firebase service account."
+        )
+    return json.loads(sa_json)
+
+def _project(sa_info: Dict) -> Optional[str]:
+    return os.getenv("FIREBASE_PROJECT_ID", sa_info.get("project_id"))
+
+def get_app():
+    # firebase_admin app, for the Admin APIs (auth...). Cheap: it opens no
+    # connection, so sharing it across a fork is harmless.
+    import firebase_admin
+    from firebase_admin import credentials
+    if firebase_admin._apps:
+        return firebase_admin.get_app()
+    sa_info = service_account_info()
+    return firebase_admin.initialize_app(credentials.Certificate(sa_info), {"projectId": _project(sa_info)})
+
+def get_db():
+    # Sync Firestore client of this process. firebase_admin caches its
+    # client on the app, which a forked worker inherits, so the client is
+    # built directly and keyed on the pid instead.
+    global _pid, _client
+    if _override is not None:
+        return _override
+    pid = os.getpid()
+    if _client is not None and _pid == pid:
+        return _client
+    with _lock:
+        if _client is not None and _pid == pid:
+            return _client
+        if _client is not None:
+            stats["fork_rilevati"] += 1  # inherited from the parent: never used here
+        t = time.perf_counter()
+        from google.cloud import firestore
+        from google.oauth2 import service_account
+        stats["import_sdk_s"] = round(time.perf_counter() - t, 6)
+        t = time.perf_counter()
+        sa_info = service_account_info()
+        creds = service_account.Credentials.from_service_account_info(sa_info)
+        _client = firestore.Client(project=_project(sa_info), credentials=creds)
+        _pid = pid
+        stats["client_s"] = round(time.perf_counter() - t, 6)
+        stats["clienti_creati"] += 1
+        return _client
+
+def set_db(client):
+    # Overrides get_db() (benchmarks, tests, emulator clients); None restores
+    # the default.
+    global _override
+    _override = client
+
+def get_async_db():
+    # AsyncClient for the ASGI entry point. Created inside the running loop
+    # (the gRPC aio channel binds to the loop that creates it) and again in
+    # a new process or loop.
+    global _async
+    loop = asyncio.get_running_loop()
+    pid = os.getpid()
+    if _async is not None and _async[0] == pid and _async[1] is loop:
+        return _async[2]
+    from google.cloud.firestore import AsyncClient
+    from google.oauth2 import service_account
+    sa_info = service_account_info()
+    creds = service_account.Credentials.from_service_account_info(sa_info)
+    client = AsyncClient(project=_project(sa_info), credentials=creds)
+    _async = (pid, loop, client)
+    return client
+
+def warmup(probe: Optional[Callable[[Any], Any]] = None):
+    # Builds the client and runs probe(client), typically one cheap read, so
+    # the channel is connected before the first request needs it.
+    t = time.perf_counter()
+    client = get_db()
+    if probe is not None:
+        probe(client)
+    stats["warmup_s"] = round(time.perf_counter() - t, 6)
+
+def warmup_in_background(probe: Optional[Callable[[Any], Any]] = None) -> threading.Thread:
+    def run():
+        try:
+            warmup(probe)
+        except Exception:
+            stats["warmup_errori"] += 1  # the first request retries (and reports) it
+    th = threading.Thread(target=run, name="firebase-warmup", daemon=True)
+    th.start()
+    return th
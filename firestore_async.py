@@ -0,0 +1,189 @@
+# Async counterpart of firestore_layer for the ASGI entry point (app_async).
+# Reads are still answered from the shared in-process replica when it is
+# serving; otherwise they go to Firestore through AsyncClient, with
+# independent queries and batch commits issued concurrently via
+# asyncio.gather. Replica calls run in a worker thread: serving() may build
+# the sync client or (re)start the listener, and the replica lock is held
+# by the listener thread while it applies a full snapshot.
+import time, asyncio
+from typing import Dict, List, Optional, Tuple
+
+from eventi import Evento, Posizione
+
+from firebase_client import get_async_db as _db
+import metrics
+from firestore_layer import (
+    BATCH_LIMIT, BULK_RETRIES, BULK_WORKERS, CACHE_ENABLED, COLL, _backoff, _bulk_prices, _bulk_report, _bulk_writes,
+    _committed, _fill_batch, _give_up, _nearby_of, _normalize, _price_data, _province_report, _replica, _ts_us, _view_of,
+    subscribe_events as _subscribe_events,
+)
+from aggregati import ProvinceAggregates
+from province import province_key
+from ricerca import Criteri, cerca_lista
+
+_MISS = object()
+
+async def _from_replica(fn, *args):
+    # fn(*args) off the event loop, or _MISS if the replica isn't serving.
+    def read():
+        return fn(*args) if _replica.serving() else _MISS
+    return await asyncio.to_thread(read)
+
+async def start_replica():
+    # Called before serving: the first snapshot arrives while the app
+    # starts instead of during the first requests.
+    if CACHE_ENABLED:
+        await asyncio.to_thread(_replica.serving)
+
+async def _collect(query) -> List[Dict]:
+    return [_normalize(doc) async for doc in metrics.astream("query", query.stream())]
+
+async def list_all_ordered() -> List[Dict]:
+    hit = await _from_replica(lambda: list(_replica.ordered()))
+    if hit is not _MISS:
+        return hit
+    return await _collect(_db().collection(COLL).order_by("id"))
+
+async def list_page(limit: int, after: Optional[int] = None) -> List[Dict]:
+    hit = await _from_replica(_replica.page, limit, after)
+    if hit is not _MISS:
+        return hit
+    q = _db().collection(COLL).order_by("id")
+    if after is not None:
+        q = q.start_after({"id": after})
+    return await _collect(q.limit(limit))
+
+async def get_by_id(did: int) -> Optional[Dict]:
+    hit = await _from_replica(_replica.get, did)
+    if hit is not _MISS:
+        return hit
+    t = time.perf_counter()
+    doc = await _db().collection(COLL).document(str(did)).get()
+    metrics.rpc("get", time.perf_counter() - t, reads=1)
+    return _normalize(doc) if doc.exists else None
+
+async def get_many(ids: List[int]) -> Dict[int, Dict]:
+    hit = await _from_replica(lambda: {i: d for i in ids for d in (_replica.get(i),) if d is not None})
+    if hit is not _MISS:
+        return hit
+    refs = [_db().collection(COLL).document(str(i)) for i in ids]
+    return {int(doc.id): _normalize(doc) async for doc in metrics.astream("get_all", _db().get_all(refs)) if doc.exists}
+
+async def get_by_provincia(provincia: str) -> List[Dict]:
+    key = province_key(provincia)
+    if not key:
+        return []
+    hit = await _from_replica(_replica.by_provincia, key)
+    if hit is not _MISS:
+        return hit
+    # One query: see firestore_layer._province_docs.
+    docs = await _collect(_db().collection(COLL).where("provincia_key", "==", key))
+    return sorted(docs, key=lambda d: d["id"])
+
+async def get_by_province(provinces: List[str]) -> Dict[str, List[Dict]]:
+    results = await asyncio.gather(*(get_by_provincia(p) for p in provinces))
+    return dict(zip(provinces, results))
+
+async def get_aggregati(provincia: Optional[str] = None, items: Optional[List[Dict]] = None) -> Dict:
+    key = province_key(provincia) if provincia is not None else None
+    hit = await _from_replica(_replica.aggregati, key)
+    if hit is not _MISS:
+        return hit
+    if key is not None:
+        return ProvinceAggregates.build(items if items is not None else await get_by_provincia(provincia)).provincia(key)
+    agg = ProvinceAggregates.build(await list_all_ordered())
+    return {"nazionale": agg.nazionale(), "province": agg.tutte()}
+
+async def geo_view(bbox=None, zoom: Optional[int] = None) -> Tuple[List[Dict], List[Dict]]:
+    hit = await _from_replica(_replica.view, bbox, zoom)
+    if hit is not _MISS:
+        return hit
+    return _view_of(await list_all_ordered(), bbox, zoom)
+
+async def get_nearby(lat: float, lon: float, k: Optional[int] = None, raggio_km: Optional[float] = None) -> List[Tuple[float, Dict]]:
+    if k is None and raggio_km is None:
+        raise ValueError("Specificare almeno uno tra 'k' o 'raggio_km'")
+    hit = await _from_replica(_replica.nearby, lat, lon, k, raggio_km)
+    if hit is not _MISS:
+        return hit
+    return _nearby_of(await list_all_ordered(), lat, lon, k, raggio_km)
+
+async def cerca(c: Criteri) -> List[Tuple[Optional[float], Dict]]:
+    hit = await _from_replica(_replica.cerca, c)
+    if hit is not _MISS:
+        return hit
+    return cerca_lista(c, await get_by_provincia(c.provincia_key) if c.provincia_key is not None else await list_all_ordered())
+
+# --- writes ---------------------------------------------------------------
+
+async def collection_version() -> Optional[int]:
+    hit = await _from_replica(lambda: _replica.changes)
+    return None if hit is _MISS else hit
+
+async def subscribe_events(since: Optional[Posizione]) -> Optional[Tuple[int, List[Evento]]]:
+    return await asyncio.to_thread(_subscribe_events, since)
+
+async def get_delta(since: Optional[int] = None) -> Dict:
+    hit = await _from_replica(_replica.delta, since)
+    if hit is not _MISS:
+        version, full, docs, gone = hit
+    else:
+        docs, version = await _snapshot()
+        full, gone = True, []
+    return {"versione": version, "completo": full, "modificati": docs, "eliminati": gone}
+
+async def _snapshot() -> Tuple[List[Dict], int]:
+    docs, version = [], 0
+    async for doc in metrics.astream("query", _db().collection(COLL).order_by("id").stream()):
+        docs.append(_normalize(doc))
+        version = max(version, _ts_us(getattr(doc, "update_time", None)))
+    return docs, version
+
+async def _commit_chunk(chunk: List[Tuple[int, Optional[Dict]]], op: str, retries: int = BULK_RETRIES) -> Dict[int, Optional[str]]:
+    # firestore_layer._commit_chunk on the loop: same retry/split policy.
+    for attempt in range(retries + 1):
+        batch = _fill_batch(_db(), chunk, op)
+        t = time.perf_counter()
+        try:
+            results = await batch.commit()
+        except Exception as e:
+            metrics.rpc("commit", time.perf_counter() - t)
+            err, delay = e, _backoff(e, attempt, retries)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+            continue
+        metrics.rpc("commit", time.perf_counter() - t, writes=len(chunk))
+        return await asyncio.to_thread(_committed, chunk, results)
+    failed, halves = _give_up(chunk, err)
+    for res in await asyncio.gather(*(_commit_chunk(half, op, 0) for half in halves)):
+        failed.update(res)
+    return failed
+
+async def bulk_write(writes: Dict[int, Optional[Dict]], op: str = "update") -> Dict[int, Optional[str]]:
+    items = sorted(writes.items())
+    chunks = [items[i:i + BATCH_LIMIT] for i in range(0, len(items), BATCH_LIMIT)]
+    # At most BULK_WORKERS commits in flight, like the sync thread pool.
+    sem = asyncio.Semaphore(BULK_WORKERS)
+
+    async def commit(chunk):
+        async with sem:
+            return await _commit_chunk(chunk, op)
+
+    out: Dict[int, Optional[str]] = {}
+    for res in await asyncio.gather(*(commit(c) for c in chunks)):
+        out.update(res)
+    return out
+
+async def update_prices_by_province(provincia: str, benzina=None, diesel=None) -> Tuple[int, List[Dict]]:
+    data = _price_data(benzina, diesel)
+    items = await get_by_provincia(provincia)
+    if not items:
+        return 0, []
+    return _province_report(data, await bulk_write({d["id"]: data for d in items}))
+
+async def update_prices_bulk(province: Optional[Dict[str, Dict]] = None, distributori: Optional[Dict[int, Dict]] = None) -> Dict:
+    prov_data, station_data = _bulk_prices(province, distributori)
+    by_prov, existing = await asyncio.gather(get_by_province(list(prov_data)), get_many(list(station_data)))
+    writes, missing_prov = _bulk_writes(prov_data, station_data, by_prov, existing)
+    return _bulk_report(writes, await bulk_write(writes), sorted(set(station_data) - set(existing)), missing_prov)
@@ -1,40 +1,50 @@
-import os, json, firebase_admin
-from typing import Dict, List, Optional, Tuple
-from firebase_admin import credentials, firestore as admin_firestore
-
-if not firebase_admin._apps:
-    sa_json = os.environ.get("FIREBASE_SERVICE_ACCOUNT")
-    if not sa_json:
-        raise RuntimeError(
-            "FIREBASE_SERVICE_ACCOUNT is missing. "
-            "Add it as a Codespaces secret with the FULL service-account JSON."
-        )
-    sa_info = json.loads(sa_json)
-    cred = credentials.Certificate(sa_info)
-    firebase_admin.initialize_app(cred)
+import os, time, heapq, bisect, threading, calendar
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+from aggregati import FUELS, ProvinceAggregates
+from eventi import Evento, Posizione, broker, dopo
+import firebase_client
+from firebase_client import get_db
+import metrics
+from geo_cluster import CLUSTER_MAX_ZOOM, ClusterPyramid
+from geo_index import GridIndex, haversine_km
+from province import province_key
+from ricerca import Criteri, cerca_indici, cerca_lista
 
-db = admin_firestore.client()
+if TYPE_CHECKING:
+    from google.cloud.firestore import DocumentSnapshot
 
 COLL = "distributori"
 
-PROV_FULL = {
-    "MI": "Milano",
-    "TO": "Torino",
-    "RM": "Roma",
-    "NA": "Napoli",
-    "BO": "Bologna",
-}
-
-def _full_name(code_or_name: str) -> str:
-    code = (code_or_name or "").strip().upper()
-    if code in PROV_FULL:
-        return PROV_FULL[code]
-    for k, v in PROV_FULL.items():
-        if v.strip().upper() == code:
-            return v
-    return code_or_name
-
-def _normalize(doc: admin_firestore.DocumentSnapshot) -> Dict:
+# Read-through replica of COLL, kept current by an on_snapshot listener.
+# CACHE_MAX_STALENESS bounds how long (seconds) the replica keeps serving
+# reads after the listener has gone quiet/disconnected before we fall back
+# to direct Firestore reads.
+CACHE_ENABLED = os.environ.get("CACHE_ENABLED", "1") != "0"
+CACHE_MAX_STALENESS = float(os.environ.get("CACHE_MAX_STALENESS", "30"))
+
+# Max operations Firestore accepts in one batch.
+BATCH_LIMIT = 500
+# Bulk writes: concurrent batch commits and per-batch retries.
+BULK_WORKERS = int(os.environ.get("BULK_WORKERS", "8"))
+BULK_RETRIES = 3
+BULK_BACKOFF = 0.2
+# Errors retrying won't fix; the batch is split straight away instead.
+_PERMANENT_ERRORS = {"NotFound", "InvalidArgument", "FailedPrecondition", "PermissionDenied"}
+
+# Deletions remembered for delta sync; older ones are forgotten and clients
+# asking from before them get a full snapshot instead.
+DELTA_TOMBSTONES = int(os.environ.get("DELTA_TOMBSTONES", "50000"))
+
+# How long a get_by_id miss is remembered when reading Firestore directly.
+NEG_CACHE_TTL = float(os.environ.get("NEG_CACHE_TTL", "5"))
+NEG_CACHE_MAX = 10000
+
+def _normalize(doc: "DocumentSnapshot", derive_key: bool = True) -> Dict:
+    # derive_key=False leaves a missing provincia_key missing, for callers
+    # diffing against what is actually stored (the importer).
+    t = time.perf_counter()
     d = doc.to_dict() or {}
     d["id"] = int(d["id"])
     d["lat"] = float(d["lat"])
@@ -46,57 +56,830 @@ def _normalize(doc: admin_firestore.DocumentSnapshot) -> Dict:
         "benzina": float(lc.get("benzina", 0.0)),
         "diesel": float(lc.get("diesel", 0.0)),
     }
+    if derive_key or d.get("provincia_key"):
+        d["provincia_key"] = d.get("provincia_key") or province_key(d.get("provincia", ""))
+    metrics.phase("normalize", time.perf_counter() - t)
     return d
 
+def _merge_fields(cur: Dict, data: Dict) -> Dict:
+    # Copy of cur with data applied; dotted keys ("livello_carburante.diesel")
+    # update nested maps the way Firestore's update() does.
+    out = dict(cur)
+    for key, value in data.items():
+        if "." not in key:
+            out[key] = value
+            continue
+        parent, child = key.split(".", 1)
+        out[parent] = _merge_fields(out.get(parent) or {}, {child: value})
+    return out
+
+def _ts_us(ts) -> int:
+    if ts is None:
+        return 0
+    return calendar.timegm(ts.utctimetuple()) * 1_000_000 + ts.microsecond
+
+def _delta(old: Optional[Dict], new: Dict) -> Dict:
+    # Price and level fields that differ between two versions of a station.
+    out = {f: new[f] for f in ("prezzo_benzina", "prezzo_diesel") if old is None or old[f] != new[f]}
+    livelli = {f: new["livello_carburante"][f] for f in FUELS
+               if old is None or old["livello_carburante"][f] != new["livello_carburante"][f]}
+    if livelli:
+        out["livello_carburante"] = livelli
+    return out
+
+class _Replica:
+    def __init__(self, max_staleness: float):
+        self.max_staleness = max_staleness
+        self._lock = threading.RLock()
+        self._docs: Dict[int, Dict] = {}
+        self._versions: Dict[int, int] = {}
+        # Newest time the listener has confirmed: every commit up to it has
+        # been applied. Writes applied locally don't move it (an older
+        # commit from another process may still be on its way).
+        self.version = 0
+        # Local writes the listener hasn't delivered yet: id -> (station
+        # as last delivered, its version).
+        self._unconfirmed: Dict[int, Tuple[Dict, int]] = {}
+        # Changes applied so far, in arrival order: keys the response cache.
+        # The version can't, since a late commit from another process may
+        # carry an older timestamp and leave it unchanged.
+        self.changes = 0
+        self._tombstones: Dict[int, int] = {}  # id -> version of the deletion
+        self._base: Optional[int] = None       # oldest version a delta can start from
+        self._ordered: Optional[List[Dict]] = None
+        self._ordered_ids: List[int] = []
+        self._by_prov: Dict[str, set] = {}
+        self._geo = GridIndex()
+        self._clusters = ClusterPyramid()
+        self._agg = ProvinceAggregates()
+        self._watch = None
+        self._generation = 0
+        self._synced_generation = -1
+        self._healthy_at = 0.0
+        self._restarted_at = 0.0
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "resyncs": 0}
+
+    # --- listener -------------------------------------------------------
+
+    def _start(self):
+        self._generation += 1
+        gen = self._generation
+        self._restarted_at = time.monotonic()
+        self._watch = get_db().collection(COLL).on_snapshot(
+            lambda docs, changes, read_time: self._on_snapshot(gen, docs, changes, read_time)
+        )
+
+    def _restart(self):
+        old, self._watch = self._watch, None
+        if old is not None:
+            try:
+                old.unsubscribe()
+            except Exception:
+                pass
+        self.stats["resyncs"] += 1
+        self._start()
+
+    def _on_snapshot(self, gen: int, docs, changes, read_time=None):
+        metrics.reads("listener", len(changes))
+        with self._lock:
+            if gen != self._generation:
+                return
+            if self._synced_generation != gen:
+                # First snapshot of a (re)started listener carries the whole
+                # collection: rebuild, so deletions missed while disconnected
+                # don't linger.
+                fresh = {}
+                for doc in docs:
+                    fresh[int(doc.get("id"))] = doc
+                for did in list(self._docs):
+                    if did not in fresh:
+                        self._remove(did, read_time)
+                for did, doc in fresh.items():
+                    self._put(doc, force=True)
+                if self._synced_generation < 0:
+                    # Deletions before this snapshot are unknown: history
+                    # starts at its read time.
+                    self._bump(_ts_us(read_time))
+                    self._base = self.version
+                    broker.reset(self.version)
+                self._synced_generation = gen
+            else:
+                # Oldest commit first, so events go out in version order.
+                removed_at = _ts_us(read_time)
+                for ch in sorted(changes, key=lambda ch: removed_at if ch.type.name == "REMOVED"
+                                 else _ts_us(getattr(ch.document, "update_time", None))):
+                    if ch.type.name == "REMOVED":
+                        self._remove(int(ch.document.get("id")), read_time)
+                    else:
+                        self._put(ch.document)
+            if read_time is not None:
+                self._bump(_ts_us(read_time))
+            self._ordered = None
+            self._healthy_at = time.monotonic()
+
+    def _put(self, doc, force: bool = False):
+        d = _normalize(doc)
+        version = _ts_us(getattr(doc, "update_time", None))
+        if not force and version and version < self._versions.get(d["id"], 0):
+            return
+        # Events describe the change from what the listener last delivered,
+        # including fields this process already applied locally.
+        old, _ = self._unconfirmed.pop(d["id"], (self._docs.get(d["id"]), 0))
+        self._store(d)
+        self.changes += 1
+        self._versions[d["id"]] = version
+        self._tombstones.pop(d["id"], None)
+        self._bump(version)
+        self._publish(old, d)
+
+    def _remove(self, did: int, read_time=None):
+        old = self._docs.pop(did, None)
+        self._unconfirmed.pop(did, None)
+        self._unindex(old)
+        if old is not None:
+            self.changes += 1
+        self._versions.pop(did, None)
+        self._bump(_ts_us(read_time))
+        if old is not None and self._synced_generation >= 0:
+            self._tombstones[did] = self.version
+            if len(self._tombstones) > DELTA_TOMBSTONES:
+                # Oldest first (insertion order): deltas from before it
+                # would miss this deletion.
+                gone = next(iter(self._tombstones))
+                self._base = max(self._base or 0, self._tombstones.pop(gone))
+            broker.publish(self.version, "eliminato", {"id": did})
+
+    def _publish(self, old: Optional[Dict], new: Dict):
+        # No events while the first snapshot loads the collection.
+        if self._synced_generation < 0:
+            return
+        # Versioned with the station's own update time, not the collection
+        # version, so its event id is the same on every worker.
+        delta = _delta(old, new)
+        if delta:
+            broker.publish(self._versions.get(new["id"], self.version), "distributore", {"id": new["id"], **delta})
+
+    def _bump(self, version: int):
+        # Newest server timestamp delivered by the listener, so every
+        # write or delete it reports moves the version forward.
+        if version:
+            self.version = max(self.version, version)
+        else:
+            self.version += 1
+
+    def _store(self, d: Dict):
+        self._unindex(self._docs.get(d["id"]))
+        self._docs[d["id"]] = d
+        self._by_prov.setdefault(d["provincia_key"], set()).add(d["id"])
+        self._geo.upsert(d["id"], d["lat"], d["lon"])
+        self._clusters.add(d)
+        self._agg.add(d)
+
+    def _unindex(self, old: Optional[Dict]):
+        if old is None:
+            return
+        ids = self._by_prov.get(old["provincia_key"])
+        if ids is not None:
+            ids.discard(old["id"])
+            if not ids:
+                del self._by_prov[old["provincia_key"]]
+        self._geo.remove(old["id"])
+        self._clusters.remove(old)
+        self._agg.remove(old)
+
+    # --- reads ----------------------------------------------------------
+
+    def serving(self) -> bool:
+        if not CACHE_ENABLED:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if self._watch is None:
+                try:
+                    self._start()
+                except Exception:
+                    self._watch = None
+                    self.stats["misses"] += 1
+                    return False
+            synced = self._synced_generation == self._generation
+            if synced and getattr(self._watch, "is_active", True):
+                self._healthy_at = now
+            if synced and now - self._healthy_at <= self.max_staleness:
+                self.stats["hits"] += 1
+                return True
+            if synced:
+                self.stats["stale"] += 1
+            else:
+                self.stats["misses"] += 1
+            if now - self._restarted_at > self.max_staleness:
+                self._restart()
+            return False
+
+    def ordered(self) -> List[Dict]:
+        with self._lock:
+            if self._ordered is None:
+                self._ordered_ids = sorted(self._docs)
+                self._ordered = [self._docs[k] for k in self._ordered_ids]
+            return self._ordered
+
+    def page(self, limit: int, after: Optional[int]) -> List[Dict]:
+        with self._lock:
+            ordered = self.ordered()
+            start = 0 if after is None else bisect.bisect_right(self._ordered_ids, after)
+            return ordered[start:start + limit]
+
+    def get(self, did: int) -> Optional[Dict]:
+        return self._docs.get(did)
+
+    def by_provincia(self, key: str) -> List[Dict]:
+        with self._lock:
+            return [self._docs[i] for i in sorted(self._by_prov.get(key, ()))]
+
+    def nearby(self, lat: float, lon: float, k: Optional[int], raggio_km: Optional[float]) -> List[Tuple[float, Dict]]:
+        with self._lock:
+            if k is None:
+                hits = self._geo.within(lat, lon, raggio_km)
+            else:
+                hits = self._geo.nearest(lat, lon, k, raggio_km)
+            return [(dist, self._docs[did]) for dist, did in hits]
+
+    def cerca(self, c: Criteri) -> List[Tuple[Optional[float], Dict]]:
+        with self._lock:
+            return cerca_indici(c, self._docs, self._agg, self._geo, self._by_prov)
+
+    def view(self, bbox, zoom: Optional[int]) -> Tuple[List[Dict], List[Dict]]:
+        with self._lock:
+            if zoom is not None and zoom <= CLUSTER_MAX_ZOOM:
+                ids, clusters = self._clusters.query(zoom, bbox)
+            else:
+                ids = self._geo.in_bbox(*bbox) if bbox else list(self._docs)
+                clusters = []
+            return [self._docs[i] for i in sorted(ids)], clusters
+
+    # --- writes through this process --------------------------------------
+
+    def apply_local(self, did: int, data: Dict, update_time=None):
+        # Read-your-writes until the listener delivers the commit, which
+        # then moves the version and publishes the event.
+        with self._lock:
+            cur = self._docs.get(did)
+            version = _ts_us(update_time)
+            if cur is None or (version and version <= self._versions.get(did, 0)):
+                return  # the listener got there first
+            self._unconfirmed.setdefault(did, (cur, self._versions.get(did, 0)))
+            self._store(_merge_fields(cur, data))
+            self.changes += 1
+            self._versions[did] = version or self._versions.get(did, 0)
+            self._ordered = None
+
+    def delta(self, since: Optional[int]) -> Tuple[int, bool, List[Dict], List[int]]:
+        # (version, full, changed stations, deleted ids) after `since`. full
+        # means the changes can't be reconstructed from that point (or no
+        # since given) and the stations are the whole collection. The
+        # version is the listener's, so nothing committed up to it can still
+        # arrive; local writes past it are sent again next time.
+        with self._lock:
+            if since is None or self._base is None or since < self._base:
+                return self.version, True, list(self.ordered()), []
+            changed = sorted(did for did, v in self._versions.items() if v > since)
+            gone = sorted(did for did, v in self._tombstones.items() if v > since)
+            return self.version, False, [self._docs[did] for did in changed], gone
+
+    def changed_since(self, since: Posizione) -> List[Evento]:
+        # Current prices/levels of every station written after `since`,
+        # oldest first: resume for clients the event ring can't cover.
+        # Local writes replay as last delivered: their ids must not run
+        # ahead of the listener either.
+        with self._lock:
+            confirmed = {did: self._unconfirmed.get(did, (self._docs[did], v)) for did, v in self._versions.items()}
+            changed = sorted((v, did) for did, (_, v) in confirmed.items() if v >= since[0])
+            events = [(v, "distributore", {"id": did, **_delta(None, confirmed[did][0])}) for v, did in changed]
+            return [ev for ev in events if dopo(ev, since)]
+
+    def aggregati(self, key: Optional[str]) -> Dict:
+        with self._lock:
+            if key is not None:
+                return self._agg.provincia(key)
+            return {"nazionale": self._agg.nazionale(), "province": self._agg.tutte()}
+
+    def snapshot_stats(self) -> Dict:
+        with self._lock:
+            out = dict(self.stats)
+            out["documenti"] = len(self._docs)
+            out["sincronizzato"] = self._synced_generation == self._generation
+            out["eta_s"] = round(time.monotonic() - self._healthy_at, 3) if self._healthy_at else None
+            return out
+
+_replica = _Replica(CACHE_MAX_STALENESS)
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+class _SharedStream:
+    # One query stream read by several callers. Whoever reaches the end of
+    # what has arrived pulls the next document, so a slow client never
+    # stalls the others; documents stay in memory until every reader is done.
+
+    def __init__(self, source: Iterator, on_done):
+        self._lock = threading.Lock()
+        self._source = source
+        self._on_done = on_done
+        self._items: List = []
+        self._error: Optional[BaseException] = None
+        self._readers = 0
+        self.done = False
+
+    def join(self) -> bool:
+        # Registers one more reader; False once the stream is over.
+        with self._lock:
+            if self.done:
+                return False
+            self._readers += 1
+            return True
+
+    def reader(self) -> Iterator:
+        # For a caller that join()ed.
+        try:
+            i = 0
+            while True:
+                if i < len(self._items):
+                    yield self._items[i]
+                    i += 1
+                    continue
+                with self._lock:
+                    if i < len(self._items):
+                        continue
+                    if not self.done:
+                        try:
+                            self._items.append(next(self._source))
+                            continue
+                        except StopIteration:
+                            self.done = True
+                        except BaseException as e:
+                            self._error, self.done = e, True
+                if self._error is not None:
+                    raise self._error
+                return
+        finally:
+            with self._lock:
+                self._readers -= 1
+                # Every client went away: nobody to hand the rest to.
+                self.done = self.done or not self._readers
+            if self.done:
+                self._on_done(self)
+
+class _SingleFlight:
+    # Concurrent identical reads (same key) share one in-flight Firestore
+    # call and its result, so a burst costs one RPC per distinct query
+    # rather than one per request. Results are shared: treat them as
+    # read-only. Per process only; each worker still issues its own.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Flight] = {}
+        self._streams: Dict[str, _SharedStream] = {}
+        self.stats = {"eseguite": 0, "condivise": 0}
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Flight()
+                self.stats["eseguite"] += 1
+            else:
+                self.stats["condivise"] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stream(self, key: str, fn) -> Iterator:
+        # do() for streamed reads: fn() returns an iterator, and callers
+        # arriving while it is open replay what it delivered, then follow it.
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is None or not shared.join():
+                shared = self._streams[key] = _SharedStream(fn(), lambda s: self._ended(key, s))
+                shared.join()
+                self.stats["eseguite"] += 1
+            else:
+                self.stats["condivise"] += 1
+        return shared.reader()
+
+    def _ended(self, key: str, shared: _SharedStream):
+        with self._lock:
+            if self._streams.get(key) is shared:
+                del self._streams[key]
+
+class _NegativeCache:
+    # Ids recently found missing, so repeated 404s don't each cost a read.
+    # Writes through this process clear their ids; documents created
+    # elsewhere show up after at most ttl seconds.
+
+    def __init__(self, ttl: float = NEG_CACHE_TTL, max_entries: int = NEG_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._until: Dict[int, float] = {}
+        self.stats = {"hits": 0}
+
+    def __contains__(self, did: int) -> bool:
+        with self._lock:
+            until = self._until.get(did)
+            if until is None:
+                return False
+            if until < time.monotonic():
+                del self._until[did]
+                return False
+            self.stats["hits"] += 1
+            return True
+
+    def add(self, did: int):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._until.pop(did, None)
+            self._until[did] = time.monotonic() + self.ttl
+            while len(self._until) > self.max_entries:
+                del self._until[next(iter(self._until))]
+
+    def discard(self, ids):
+        with self._lock:
+            for did in ids:
+                self._until.pop(did, None)
+
+_flight = _SingleFlight()
+_missing = _NegativeCache()
+
+def collection_version() -> Optional[int]:
+    # Replica change count: moves on every change applied, in whatever
+    # order commits arrive. None when reads are not served from the
+    # replica (no stable version).
+    return _replica.changes if _replica.serving() else None
+
+def warmup():
+    # Post-fork warm-up (FIREBASE_WARMUP=1): one read connects the channel,
+    # then the listener starts so the first requests find the replica synced.
+    def probe(client):
+        list(client.collection(COLL).limit(1).stream())
+        if CACHE_ENABLED:
+            _replica.serving()
+    return firebase_client.warmup_in_background(probe)
+
+def cache_stats() -> Dict:
+    return _replica.snapshot_stats()
+
+def read_stats() -> Dict:
+    # Direct (non-replica) reads: executed vs coalesced calls, and 404s
+    # answered from the negative cache.
+    return {**_flight.stats, "mancanti_in_cache": _missing.stats["hits"]}
+
+def subscribe_events(since: Optional[Posizione]) -> Optional[Tuple[int, List[Evento]]]:
+    # (broker cursor, events to replay first), or None without a replica
+    # (CACHE_ENABLED=0) to drive the stream.
+    if not CACHE_ENABLED:
+        return None
+    _replica.serving()  # starts the listener if nobody has yet
+    cursor, backlog = broker.subscribe(since)
+    if backlog is None:
+        backlog = _replica.changed_since(since)
+    return cursor, backlog
+
+def get_delta(since: Optional[int] = None) -> Dict:
+    # Stations changed after version `since` plus ids deleted since then;
+    # "versione" is what the client passes as since next time. With
+    # "completo" the stations are the whole collection and replace the
+    # client's copy.
+    if _replica.serving():
+        version, full, docs, gone = _replica.delta(since)
+    else:
+        # No change history without the replica: full snapshot, versioned by
+        # the newest update time in it.
+        docs, version = _flight.do("snapshot", _snapshot)
+        full, gone = True, []
+    return {"versione": version, "completo": full, "modificati": docs, "eliminati": gone}
+
+def _snapshot() -> Tuple[List[Dict], int]:
+    docs, version = [], 0
+    for doc in metrics.stream("query", get_db().collection(COLL).order_by("id").stream()):
+        docs.append(_normalize(doc))
+        version = max(version, _ts_us(getattr(doc, "update_time", None)))
+    return docs, version
+
 def list_all_ordered() -> List[Dict]:
-    qs = db.collection(COLL).order_by("id").stream()
-    return [_normalize(doc) for doc in qs]
+    if _replica.serving():
+        return list(_replica.ordered())
+    return list(_flight.do("lista", lambda: [_normalize(doc) for doc in metrics.stream("query", get_db().collection(COLL).order_by("id").stream())]))
+
+def iter_all_ordered() -> Iterator[Dict]:
+    # Like list_all_ordered, but yields documents as the stream delivers
+    # them instead of materializing the whole collection.
+    if _replica.serving():
+        yield from _replica.ordered()
+        return
+    # Concurrent callers share one query (and its normalized documents).
+    yield from _flight.stream("lista", lambda: (_normalize(doc) for doc in metrics.stream("query", get_db().collection(COLL).order_by("id").stream())))
+
+def list_page(limit: int, after: Optional[int] = None) -> List[Dict]:
+    # Keyset pagination on id: up to `limit` stations with id > after.
+    if _replica.serving():
+        return _replica.page(limit, after)
+    return list(_flight.do(f"pagina:{limit}:{after}", lambda: _page(limit, after)))
+
+def _page(limit: int, after: Optional[int]) -> List[Dict]:
+    q = get_db().collection(COLL).order_by("id")
+    if after is not None:
+        q = q.start_after({"id": after})
+    return [_normalize(doc) for doc in metrics.stream("query", q.limit(limit).stream())]
 
 def get_by_id(did: int) -> Optional[Dict]:
-    doc = db.collection(COLL).document(str(did)).get()
-    return _normalize(doc) if doc.exists else None
+    if _replica.serving():
+        return _replica.get(did)
+    if did in _missing:
+        return None
+    return _flight.do(f"id:{did}", lambda: _get_doc(did))
+
+def _get_doc(did: int) -> Optional[Dict]:
+    t = time.perf_counter()
+    doc = get_db().collection(COLL).document(str(did)).get()
+    metrics.rpc("get", time.perf_counter() - t, reads=1)
+    if not doc.exists:
+        _missing.add(did)
+        return None
+    return _normalize(doc)
 
 def get_by_provincia(provincia: str) -> List[Dict]:
-    code = provincia.strip().upper()
-    name = _full_name(provincia)
-    docs = []
-    for value in {code, name}:
-        if not value:
-            continue
-        docs.extend(db.collection(COLL).where("provincia", "==", value).stream())
-    seen, out = set(), []
-    for doc in docs:
-        if doc.id in seen:
-            continue
-        seen.add(doc.id)
-        out.append(_normalize(doc))
-    return out
+    key = province_key(provincia)
+    if not key:
+        return []
+    if _replica.serving():
+        return _replica.by_provincia(key)
+    return list(_flight.do(f"provincia:{key}", lambda: _province_docs(key)))
+
+def _province_docs(key: str) -> List[Dict]:
+    # One query on provincia_key: documents written before it existed need
+    # backfill_province_keys (firestoreDataPopulator --backfill-province).
+    q = get_db().collection(COLL).where("provincia_key", "==", key)
+    return sorted((_normalize(doc) for doc in metrics.stream("query", q.stream())), key=lambda d: d["id"])
+
+def get_aggregati(provincia: Optional[str] = None, items: Optional[List[Dict]] = None) -> Dict:
+    # Without provincia: national totals plus one entry per province key.
+    # items, if the caller already has the province's stations, saves a
+    # second query when the replica is not serving.
+    key = province_key(provincia) if provincia is not None else None
+    if _replica.serving():
+        return _replica.aggregati(key)
+    if key is not None:
+        return ProvinceAggregates.build(items if items is not None else get_by_provincia(provincia)).provincia(key)
+    agg = ProvinceAggregates.build(list_all_ordered())
+    return {"nazionale": agg.nazionale(), "province": agg.tutte()}
 
 def geo_all() -> List[Dict]:
     return list_all_ordered()
 
-def update_prices_by_province(provincia: str, benzina=None, diesel=None) -> Tuple[int, List[Dict]]:
+def geo_view(bbox=None, zoom: Optional[int] = None) -> Tuple[List[Dict], List[Dict]]:
+    # Stations and clusters visible in bbox (west, south, east, north).
+    # At zoom <= CLUSTER_MAX_ZOOM nearby stations are merged into clusters.
+    if _replica.serving():
+        return _replica.view(bbox, zoom)
+    return _view_of(geo_all(), bbox, zoom)
+
+def _view_of(docs: List[Dict], bbox, zoom: Optional[int]) -> Tuple[List[Dict], List[Dict]]:
+    if bbox:
+        west, south, east, north = bbox
+        docs = [d for d in docs if south <= d["lat"] <= north and west <= d["lon"] <= east]
+    if zoom is None or zoom > CLUSTER_MAX_ZOOM:
+        return docs, []
+    pyramid = ClusterPyramid(zoom, zoom)
+    for d in docs:
+        pyramid.add(d)
+    by_id = {d["id"]: d for d in docs}
+    ids, clusters = pyramid.query(zoom, None)
+    return [by_id[i] for i in sorted(ids)], clusters
+
+def get_nearby(lat: float, lon: float, k: Optional[int] = None, raggio_km: Optional[float] = None) -> List[Tuple[float, Dict]]:
+    # k nearest stations and/or all stations within raggio_km, as
+    # (distance_km, station) sorted by distance.
+    if k is None and raggio_km is None:
+        raise ValueError("Specificare almeno uno tra 'k' o 'raggio_km'")
+    if _replica.serving():
+        return _replica.nearby(lat, lon, k, raggio_km)
+    return _nearby_of(list_all_ordered(), lat, lon, k, raggio_km)
+
+def cerca(c: Criteri) -> List[Tuple[Optional[float], Dict]]:
+    # Filtered top-k search, as (distance_km or None, station) in result order.
+    if _replica.serving():
+        return _replica.cerca(c)
+    return cerca_lista(c, get_by_provincia(c.provincia_key) if c.provincia_key is not None else list_all_ordered())
+
+def _nearby_of(docs: List[Dict], lat: float, lon: float, k: Optional[int], raggio_km: Optional[float]) -> List[Tuple[float, Dict]]:
+    scored = ((haversine_km(lat, lon, d["lat"], d["lon"]), d) for d in docs)
+    if raggio_km is not None:
+        scored = (s for s in scored if s[0] <= raggio_km)
+    if k is None:
+        return sorted(scored, key=lambda s: s[0])
+    return heapq.nsmallest(k, scored, key=lambda s: s[0])
+
+def _price_data(benzina=None, diesel=None) -> Dict:
     if benzina is None and diesel is None:
         raise ValueError("Specificare almeno uno tra 'benzina' o 'diesel'")
-    if benzina is not None and float(benzina) <= 0:
-        raise ValueError("Il prezzo benzina deve essere > 0")
-    if diesel is not None and float(diesel) <= 0:
-        raise ValueError("Il prezzo diesel deve essere > 0")
+    data = {}
+    for fuel, value in (("benzina", benzina), ("diesel", diesel)):
+        if value is None:
+            continue
+        try:
+            prezzo = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Il prezzo {fuel} deve essere un numero")
+        if prezzo <= 0:
+            raise ValueError(f"Il prezzo {fuel} deve essere > 0")
+        data[f"prezzo_{fuel}"] = prezzo
+    return data
+
+def _fill_batch(client, chunk: List[Tuple[int, Optional[Dict]]], op: str):
+    batch = client.batch()
+    for did, data in chunk:
+        ref = client.collection(COLL).document(str(did))
+        if data is None:
+            batch.delete(ref)
+        elif op == "set":
+            batch.set(ref, data, merge=True)
+        else:
+            batch.update(ref, data)
+    return batch
+
+# Commit policy shared with firestore_async: retry transient failures
+# with backoff; a permanent error splits the chunk in halves (tried once
+# each) so one bad document, e.g. a deleted id, only fails itself.
+
+def _backoff(err: Exception, attempt: int, retries: int) -> Optional[float]:
+    # Seconds to wait before retrying a failed commit, None to stop.
+    if type(err).__name__ in _PERMANENT_ERRORS or attempt == retries:
+        return None
+    return BULK_BACKOFF * 2 ** attempt
+
+def _give_up(chunk: List[Tuple[int, Optional[Dict]]], err: Exception) -> Tuple[Dict[int, Optional[str]], List]:
+    # After the last attempt: (failed ids, halves to try once each).
+    if len(chunk) == 1 or type(err).__name__ not in _PERMANENT_ERRORS:
+        # Transient failure past its retries (Unavailable...): splitting
+        # would only multiply commits against a backend that is down.
+        return {did: f"{type(err).__name__}: {err}" for did, _ in chunk}, []
+    mid = len(chunk) // 2
+    return {}, [chunk[:mid], chunk[mid:]]
+
+def _committed(chunk: List[Tuple[int, Optional[Dict]]], results) -> Dict[int, Optional[str]]:
+    for (did, data), res in zip(chunk, results):
+        if data is not None:
+            _replica.apply_local(did, data, getattr(res, "update_time", None))
+    _missing.discard(did for did, data in chunk if data is not None)
+    return {did: None for did, _ in chunk}
 
+def _commit_chunk(chunk: List[Tuple[int, Optional[Dict]]], op: str, retries: int = BULK_RETRIES) -> Dict[int, Optional[str]]:
+    for attempt in range(retries + 1):
+        batch = _fill_batch(get_db(), chunk, op)
+        t = time.perf_counter()
+        try:
+            results = batch.commit()
+        except Exception as e:
+            metrics.rpc("commit", time.perf_counter() - t)
+            err, delay = e, _backoff(e, attempt, retries)
+            if delay is None:
+                break
+            time.sleep(delay)
+            continue
+        metrics.rpc("commit", time.perf_counter() - t, writes=len(chunk))
+        return _committed(chunk, results)
+    failed, halves = _give_up(chunk, err)
+    for half in halves:
+        failed.update(_commit_chunk(half, op, 0))
+    return failed
+
+def bulk_write(writes: Dict[int, Optional[Dict]], op: str = "update", workers: int = BULK_WORKERS) -> Dict[int, Optional[str]]:
+    # Writes many documents in BATCH_LIMIT-sized batches committed
+    # concurrently. op is "update" or "set" (merge); a None payload deletes
+    # the document. Returns id -> None on success or the error message.
+    # workers=1 commits serially in the calling thread (usable at
+    # interpreter exit, when executors refuse new work).
+    items = sorted(writes.items())
+    chunks = [items[i:i + BATCH_LIMIT] for i in range(0, len(items), BATCH_LIMIT)]
+    if not chunks:
+        return {}
+    out: Dict[int, Optional[str]] = {}
+    if workers <= 1 or len(chunks) == 1:
+        for c in chunks:
+            out.update(_commit_chunk(c, op))
+        return out
+    with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+        for res in pool.map(lambda c: _commit_chunk(c, op), chunks):
+            out.update(res)
+    return out
+
+def existing_ids(ids: List[int], remote: bool = True) -> Optional[set]:
+    # remote=False: answer only from the replica, None if it isn't serving.
+    if _replica.serving():
+        return {i for i in ids if _replica.get(i) is not None}
+    if not remote:
+        return None
+    refs = [get_db().collection(COLL).document(str(i)) for i in ids]
+    return {int(doc.id) for doc in metrics.stream("get_all", get_db().get_all(refs)) if doc.exists}
+
+def update_prices_by_province(provincia: str, benzina=None, diesel=None) -> Tuple[int, List[Dict]]:
+    data = _price_data(benzina, diesel)
     items = get_by_provincia(provincia)
     if not items:
         return 0, []
+    return _province_report(data, bulk_write({d["id"]: data for d in items}))
+
+def _province_report(data: Dict, results: Dict[int, Optional[str]]) -> Tuple[int, List[Dict]]:
+    updated = [{"id": did, **data} if err is None else {"id": did, "errore": err} for did, err in sorted(results.items())]
+    return sum(1 for err in results.values() if err is None), updated
+
+def update_prices_bulk(province: Optional[Dict[str, Dict]] = None, distributori: Optional[Dict[int, Dict]] = None) -> Dict:
+    # province: {provincia: {"benzina": .., "diesel": ..}}
+    # distributori: {id: {"benzina": .., "diesel": ..}}, applied on top of
+    # the province prices for the same station.
+    prov_data, station_data = _bulk_prices(province, distributori)
+    with ThreadPoolExecutor(max_workers=max(1, min(BULK_WORKERS, len(prov_data)))) as pool:
+        by_prov = dict(zip(prov_data, pool.map(get_by_provincia, prov_data)))
+    existing = existing_ids(list(station_data)) if station_data else set()
+    writes, missing_prov = _bulk_writes(prov_data, station_data, by_prov, existing)
+    return _bulk_report(writes, bulk_write(writes), sorted(set(station_data) - set(existing)), missing_prov)
+
+def _bulk_writes(prov_data: Dict[str, Dict], station_data: Dict[int, Dict], by_prov: Dict[str, List[Dict]], existing) -> Tuple[Dict[int, Dict], List[str]]:
+    # Per-station writes: province prices, then each station's own on top.
+    writes: Dict[int, Dict] = {}
+    missing_prov = []
+    for prov, items in by_prov.items():
+        if not items:
+            missing_prov.append(prov)
+        for d in items:
+            writes.setdefault(d["id"], {}).update(prov_data[prov])
+    for did in existing:
+        writes.setdefault(did, {}).update(station_data[did])
+    return writes, missing_prov
+
+def _bulk_prices(province: Optional[Dict[str, Dict]], distributori: Optional[Dict[int, Dict]]) -> Tuple[Dict, Dict]:
+    province = province or {}
+    distributori = distributori or {}
+    if not province and not distributori:
+        raise ValueError("Specificare almeno una provincia o un distributore")
+    prov_data = {}
+    for prov, prices in province.items():
+        if not isinstance(prices, dict):
+            raise ValueError(f"Provincia {prov}: attesi i prezzi come oggetto")
+        try:
+            prov_data[prov] = _price_data(prices.get("benzina"), prices.get("diesel"))
+        except ValueError as e:
+            raise ValueError(f"Provincia {prov}: {e}")
+    station_data = {}
+    for did, prices in distributori.items():
+        if not isinstance(prices, dict):
+            raise ValueError(f"Distributore {did}: attesi i prezzi come oggetto")
+        try:
+            station_data[int(did)] = _price_data(prices.get("benzina"), prices.get("diesel"))
+        except ValueError as e:
+            raise ValueError(f"Distributore {did}: {e}")
+    return prov_data, station_data
+
+def _bulk_report(writes: Dict[int, Dict], results: Dict[int, Optional[str]], missing_ids: List[int], missing_prov: List[str]) -> Dict:
+    dettaglio = []
+    for did, err in sorted(results.items()):
+        if err is None:
+            dettaglio.append({"id": did, "esito": "ok", **writes[did]})
+        else:
+            dettaglio.append({"id": did, "esito": "errore", "errore": err})
+    dettaglio.extend({"id": did, "esito": "non_trovato"} for did in missing_ids)
+    return {
+        "aggiornati": sum(1 for err in results.values() if err is None),
+        "errori": sum(1 for err in results.values() if err is not None),
+        "province_non_trovate": missing_prov,
+        "dettaglio": dettaglio,
+    }
 
-    batch = db.batch()
-    updated = []
-    for d in items:
-        data = {}
-        if benzina is not None:
-            data["prezzo_benzina"] = float(benzina)
-        if diesel is not None:
-            data["prezzo_diesel"] = float(diesel)
-        ref = db.collection(COLL).document(str(d["id"]))
-        batch.update(ref, data)
-        updated.append({"id": d["id"], **data})
-    batch.commit()
-    return len(updated), updated
+def backfill_province_keys() -> int:
+    # One-off migration for documents written before provincia_key existed.
+    writes = {}
+    for doc in metrics.stream("query", get_db().collection(COLL).stream()):
+        data = doc.to_dict() or {}
+        key = province_key(data.get("provincia", ""))
+        if data.get("provincia_key") != key:
+            writes[int(data["id"])] = {"provincia_key": key}
+    results = bulk_write(writes)
+    return sum(1 for err in results.values() if err is None)
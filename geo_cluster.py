@@ -0,0 +1,92 @@
+import math
+from typing import Dict, List, Optional, Set, Tuple
+
+CLUSTER_MAX_ZOOM = 11
+CLUSTER_RADIUS_PX = 60
+TILE_PX = 256
+
+BBox = Tuple[float, float, float, float]  # west, south, east, north
+
+class _Cell:
+    __slots__ = ("ids", "lat", "lon", "prezzo_benzina", "prezzo_diesel", "litri_benzina", "litri_diesel")
+
+    def __init__(self):
+        self.ids: Set[int] = set()
+        self.lat = self.lon = 0.0
+        self.prezzo_benzina = self.prezzo_diesel = 0.0
+        self.litri_benzina = self.litri_diesel = 0.0
+
+    def add(self, d: Dict, sign: int):
+        self.lat += sign * d["lat"]
+        self.lon += sign * d["lon"]
+        self.prezzo_benzina += sign * d["prezzo_benzina"]
+        self.prezzo_diesel += sign * d["prezzo_diesel"]
+        self.litri_benzina += sign * d["livello_carburante"]["benzina"]
+        self.litri_diesel += sign * d["livello_carburante"]["diesel"]
+
+    def to_dict(self) -> Dict:
+        n = len(self.ids)
+        return {
+            "count": n,
+            "lat": self.lat / n,
+            "lon": self.lon / n,
+            "prezzi_medi": {"benzina": round(self.prezzo_benzina / n, 3), "diesel": round(self.prezzo_diesel / n, 3)},
+            "totale_litri": {"benzina": round(self.litri_benzina, 1), "diesel": round(self.litri_diesel, 1)},
+        }
+
+class ClusterPyramid:
+    # Grid clusters for every zoom level in [min_zoom, max_zoom], kept as
+    # running sums so a station change touches one cell per level. A cell
+    # spans roughly radius_px screen pixels at its zoom level.
+
+    def __init__(self, min_zoom: int = 0, max_zoom: int = CLUSTER_MAX_ZOOM, radius_px: int = CLUSTER_RADIUS_PX):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self._size = {z: radius_px * 360.0 / (TILE_PX * 2 ** z) for z in range(min_zoom, max_zoom + 1)}
+        self._levels: Dict[int, Dict[Tuple[int, int], _Cell]] = {z: {} for z in self._size}
+
+    def _key(self, z: int, lat: float, lon: float) -> Tuple[int, int]:
+        size = self._size[z]
+        return int(math.floor(lat / size)), int(math.floor(lon / size))
+
+    def add(self, d: Dict):
+        for z, cells in self._levels.items():
+            cell = cells.get(self._key(z, d["lat"], d["lon"]))
+            if cell is None:
+                cell = cells[self._key(z, d["lat"], d["lon"])] = _Cell()
+            cell.ids.add(d["id"])
+            cell.add(d, 1)
+
+    def remove(self, d: Dict):
+        for z, cells in self._levels.items():
+            key = self._key(z, d["lat"], d["lon"])
+            cell = cells.get(key)
+            if cell is None or d["id"] not in cell.ids:
+                continue
+            cell.ids.discard(d["id"])
+            if cell.ids:
+                cell.add(d, -1)
+            else:
+                del cells[key]
+
+    def query(self, zoom: int, bbox: Optional[BBox]) -> Tuple[List[int], List[Dict]]:
+        # Returns (ids of stations alone in their cell, clusters).
+        z = min(max(zoom, self.min_zoom), self.max_zoom)
+        cells = self._levels[z]
+        if bbox is None:
+            picked = cells.values()
+        else:
+            west, south, east, north = bbox
+            i0, j0 = self._key(z, south, west)
+            i1, j1 = self._key(z, north, east)
+            if (i1 - i0 + 1) * (j1 - j0 + 1) > len(cells):
+                picked = [c for (i, j), c in cells.items() if i0 <= i <= i1 and j0 <= j <= j1]
+            else:
+                picked = [c for c in (cells.get((i, j)) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)) if c]
+        singles, clusters = [], []
+        for cell in picked:
+            if len(cell.ids) == 1:
+                singles.extend(cell.ids)
+            else:
+                clusters.append(cell.to_dict())
+        return singles, clusters
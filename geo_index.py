@@ -0,0 +1,172 @@
+import heapq, math
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = math.pi * EARTH_RADIUS_KM / 180.0
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+class GridIndex:
+    # Uniform lat/lon grid: points are bucketed in cell_deg x cell_deg cells
+    # and nearest-neighbour queries walk rings of cells outwards from the
+    # query point, so cost depends on local density rather than on the total
+    # number of points. Updates are O(1).
+
+    def __init__(self, cell_deg: float = 0.05):
+        self.cell_deg = cell_deg
+        self._points: Dict[int, Tuple[float, float, Tuple[int, int]]] = {}
+        self._cells: Dict[Tuple[int, int], Set[int]] = {}
+        self._bounds: Optional[Tuple[int, int, int, int]] = None
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def upsert(self, pid: int, lat: float, lon: float):
+        cell = self._cell(lat, lon)
+        old = self._points.get(pid)
+        if old is not None and old[2] != cell:
+            self._discard(pid, old[2])
+        self._points[pid] = (lat, lon, cell)
+        self._cells.setdefault(cell, set()).add(pid)
+        if self._bounds is not None:
+            imin, imax, jmin, jmax = self._bounds
+            self._bounds = (min(imin, cell[0]), max(imax, cell[0]), min(jmin, cell[1]), max(jmax, cell[1]))
+
+    def remove(self, pid: int):
+        old = self._points.pop(pid, None)
+        if old is not None:
+            self._discard(pid, old[2])
+
+    def _discard(self, pid: int, cell: Tuple[int, int]):
+        ids = self._cells.get(cell)
+        if ids is not None:
+            ids.discard(pid)
+            if not ids:
+                del self._cells[cell]
+                self._bounds = None
+
+    def _extent(self) -> Tuple[int, int, int, int]:
+        if self._bounds is None:
+            cis = [c[0] for c in self._cells]
+            cjs = [c[1] for c in self._cells]
+            self._bounds = (min(cis), max(cis), min(cjs), max(cjs))
+        return self._bounds
+
+    def _ring(self, ci: int, cj: int, r: int) -> Iterator[Tuple[int, int]]:
+        if r == 0:
+            yield ci, cj
+            return
+        for dj in range(-r, r + 1):
+            yield ci - r, cj + dj
+            yield ci + r, cj + dj
+        for di in range(-r + 1, r):
+            yield ci + di, cj - r
+            yield ci + di, cj + r
+
+    def _ring_min_km(self, lat: float, r: int) -> float:
+        # Lower bound on the distance from the query to any point at least
+        # r whole cells away (Chebyshev) from the query's own cell.
+        if r <= 0:
+            return 0.0
+        gap = r * self.cell_deg
+        far = min(90.0, abs(lat) + (r + 1) * self.cell_deg)
+        lon_km = 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.cos(math.radians(far)) * math.sin(math.radians(gap) / 2)))
+        return min(gap * KM_PER_DEG_LAT, lon_km)
+
+    def _rings(self, ci: int, cj: int, r: int, r_last: int) -> Iterator[Tuple[int, Iterable[Tuple[int, int]]]]:
+        # (r, cells) for the rings r..r_last around (ci, cj). Once the rings
+        # walked would cost more than a pass over the occupied cells (queries
+        # far from the data), buckets those by ring instead, as in_bbox does
+        # for large boxes, and skips the empty rings.
+        spent = 0
+        while r <= r_last:
+            spent += max(1, 8 * r)
+            if spent > len(self._cells):
+                break
+            yield r, self._ring(ci, cj, r)
+            r += 1
+        else:
+            return
+        by_ring: Dict[int, List[Tuple[int, int]]] = {}
+        for i, j in self._cells:
+            d = max(abs(i - ci), abs(j - cj))
+            if d >= r:
+                by_ring.setdefault(d, []).append((i, j))
+        for d in sorted(by_ring):
+            yield d, by_ring[d]
+
+    def iter_nearest(self, lat: float, lon: float, max_km: Optional[float] = None) -> Iterator[Tuple[float, int]]:
+        # Yields (distance_km, id) in increasing distance order.
+        if not self._cells:
+            return
+        ci, cj = self._cell(lat, lon)
+        imin, imax, jmin, jmax = self._extent()
+        r = max(0, imin - ci, ci - imax, jmin - cj, cj - jmax)
+        r_last = max(ci - imin, imax - ci, cj - jmin, jmax - cj)
+        heap: List[Tuple[float, int]] = []
+        for r, cells in self._rings(ci, cj, r, r_last):
+            # Points not yet seen are in ring r or beyond: r - 1 whole cells.
+            bound = self._ring_min_km(lat, r - 1)
+            while heap and heap[0][0] <= bound:
+                item = heapq.heappop(heap)
+                if max_km is not None and item[0] > max_km:
+                    return
+                yield item
+            if max_km is not None and bound > max_km:
+                break
+            for cell in cells:
+                for pid in self._cells.get(cell, ()):
+                    plat, plon, _ = self._points[pid]
+                    heapq.heappush(heap, (haversine_km(lat, lon, plat, plon), pid))
+        while heap:
+            item = heapq.heappop(heap)
+            if max_km is not None and item[0] > max_km:
+                return
+            yield item
+
+    def nearest(self, lat: float, lon: float, k: int, max_km: Optional[float] = None) -> List[Tuple[float, int]]:
+        out = []
+        for item in self.iter_nearest(lat, lon, max_km):
+            out.append(item)
+            if len(out) >= k:
+                break
+        return out
+
+    def within(self, lat: float, lon: float, radius_km: float) -> List[Tuple[float, int]]:
+        dlat = radius_km / KM_PER_DEG_LAT
+        far = min(89.9, abs(lat) + dlat)
+        dlon = min(180.0, dlat / math.cos(math.radians(far)))
+        i0, j0 = self._cell(lat - dlat, lon - dlon)
+        i1, j1 = self._cell(lat + dlat, lon + dlon)
+        out = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for pid in self._cells.get((i, j), ()):
+                    plat, plon, _ = self._points[pid]
+                    dist = haversine_km(lat, lon, plat, plon)
+                    if dist <= radius_km:
+                        out.append((dist, pid))
+        out.sort()
+        return out
+
+    def in_bbox(self, west: float, south: float, east: float, north: float) -> List[int]:
+        i0, j0 = self._cell(south, west)
+        i1, j1 = self._cell(north, east)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._cells):
+            cells = [ids for (i, j), ids in self._cells.items() if i0 <= i <= i1 and j0 <= j <= j1]
+        else:
+            cells = [self._cells.get((i, j), ()) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+        out = []
+        for ids in cells:
+            for pid in ids:
+                lat, lon, _ = self._points[pid]
+                if south <= lat <= north and west <= lon <= east:
+                    out.append(pid)
+        return out
@@ -0,0 +1,28 @@
+# Loaded automatically by gunicorn from the working directory. Firestore
+# clients are created per worker (see firebase_client.py); with
+# FIREBASE_WARMUP=1 each worker connects and starts the replica as soon as
+# it has booted, in the background, instead of on its first request.
+import os
+import firebase_client
+
+# /api/eventi streams never end: on sync workers each open dashboard would
+# hold a whole worker, and a worker busy streaming can't heartbeat, so it
+# would be killed after `timeout` (losing its replica). gthread serves each
+# stream on one thread while the worker's main loop keeps heartbeating.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "32"))
+
+def post_worker_init(worker):
+    if not firebase_client.FIREBASE_WARMUP:
+        return
+    import firestore_layer
+    firestore_layer.warmup()
+    worker.log.info("firebase warm-up avviato (pid %s)", worker.pid)
+
+def worker_exit(server, worker):
+    # Buffered tank-level readings, written while the worker can still use
+    # its thread pool (the atexit fallback in telemetria is serial).
+    import sys
+    telemetria = sys.modules.get("telemetria")
+    if telemetria is not None:
+        telemetria.buffer.flush()
@@ -1,8 +1,10 @@
 from __future__ import annotations
-from dataclasses import dataclass, asdict, field
-from typing import List, Dict, Optional
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
 from flask import Flask, jsonify, request, render_template, abort
-from functools import cmp_to_key
+
+from province import province_key, province_name
 
 app = Flask(__name__)
 
@@ -17,85 +19,165 @@ class Distributore:
     prezzo_benzina: float = 1.899  # €/L
     prezzo_diesel: float = 1.799   # €/L
 
-    def set_prezzo(self, benzina: Optional[float] = None, diesel: Optional[float] = None):
-        if benzina is not None:
-            if benzina <= 0:
-                raise ValueError("Il prezzo benzina deve essere > 0")
-            self.prezzo_benzina = round(float(benzina), 3)
-        if diesel is not None:
-            if diesel <= 0:
-                raise ValueError("Il prezzo diesel deve essere > 0")
-            self.prezzo_diesel = round(float(diesel), 3)
-
-    def to_dict(self) -> Dict:
-        d = asdict(self)
-        d["livello_carburante"] = {
-            "benzina": float(self.livello_carburante.get("benzina", 0.0)),
-            "diesel": float(self.livello_carburante.get("diesel", 0.0)),
+class StationStore:
+    # Column-oriented station table: one typed array per field plus an
+    # id -> row index. A station costs a few machine words instead of a
+    # dataclass with its own dict, and filters/totals/updates run over
+    # whole columns with C-level loops (map/zip/sum).
+
+    def __init__(self, rows: Iterable[Distributore] = ()):
+        self.ids = array("q")
+        self.lat = array("d")
+        self.lon = array("d")
+        self.prezzo_benzina = array("d")
+        self.prezzo_diesel = array("d")
+        self.livello_benzina = array("d")
+        self.livello_diesel = array("d")
+        self.prov = array("I")           # index into _prov_values
+        self.nome: List[str] = []
+        self._prov_values: List[str] = []
+        self._prov_index: Dict[str, int] = {}
+        self._row: Dict[int, int] = {}
+        self._by_prov: Dict[str, array] = {}
+        self._order: Optional[array] = None
+        for d in rows:
+            self.add(d)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, d: Distributore):
+        lc = d.livello_carburante or {}
+        row = self._row.get(d.id)
+        if row is not None:
+            self._set_prov(row, d.provincia)
+            self.nome[row] = d.nome
+            self.lat[row], self.lon[row] = d.lat, d.lon
+            self.prezzo_benzina[row], self.prezzo_diesel[row] = d.prezzo_benzina, d.prezzo_diesel
+            self.livello_benzina[row] = float(lc.get("benzina", 0.0))
+            self.livello_diesel[row] = float(lc.get("diesel", 0.0))
+            return
+        row = len(self.ids)
+        if self._order is not None:
+            # Still sorted only if the new id is past the largest one.
+            if not self._order or d.id > self.ids[self._order[-1]]:
+                self._order.append(row)
+            else:
+                self._order = None
+        self._row[d.id] = row
+        self.ids.append(d.id)
+        self.nome.append(d.nome)
+        self.lat.append(d.lat)
+        self.lon.append(d.lon)
+        self.prezzo_benzina.append(d.prezzo_benzina)
+        self.prezzo_diesel.append(d.prezzo_diesel)
+        self.livello_benzina.append(float(lc.get("benzina", 0.0)))
+        self.livello_diesel.append(float(lc.get("diesel", 0.0)))
+        self.prov.append(self._intern(d.provincia))
+        self._by_prov.setdefault(province_key(d.provincia), array("I")).append(row)
+
+    def _intern(self, provincia: str) -> int:
+        idx = self._prov_index.get(provincia)
+        if idx is None:
+            idx = self._prov_index[provincia] = len(self._prov_values)
+            self._prov_values.append(provincia)
+        return idx
+
+    def _set_prov(self, row: int, provincia: str):
+        old = self._prov_values[self.prov[row]]
+        if old == provincia:
+            return
+        rows = self._by_prov[province_key(old)]
+        del rows[rows.index(row)]
+        self.prov[row] = self._intern(provincia)
+        self._by_prov.setdefault(province_key(provincia), array("I")).append(row)
+
+    def row_of(self, did: int) -> Optional[int]:
+        return self._row.get(did)
+
+    def ordered_rows(self) -> array:
+        # Rows sorted by id; stays valid while ids are appended in order.
+        if self._order is None:
+            self._order = array("I", sorted(range(len(self.ids)), key=self.ids.__getitem__))
+        return self._order
+
+    def rows_in(self, provincia: str) -> array:
+        return self._by_prov.get(province_key(provincia), array("I"))
+
+    def totals(self, rows: array) -> Dict[str, float]:
+        return {
+            "benzina": sum(map(self.livello_benzina.__getitem__, rows)),
+            "diesel": sum(map(self.livello_diesel.__getitem__, rows)),
         }
-        return d
 
-DISTRIBUTORI: List[Distributore] = [
+    def set_prezzi(self, rows: array, benzina: Optional[float] = None, diesel: Optional[float] = None):
+        if benzina is not None and benzina <= 0:
+            raise ValueError("Il prezzo benzina deve essere > 0")
+        if diesel is not None and diesel <= 0:
+            raise ValueError("Il prezzo diesel deve essere > 0")
+        for col, value in ((self.prezzo_benzina, benzina), (self.prezzo_diesel, diesel)):
+            if value is None:
+                continue
+            value = round(float(value), 3)
+            for row in rows:
+                col[row] = value
+
+    def to_dicts(self, rows: Iterable[int]) -> List[Dict]:
+        rows = list(rows)
+        cols = [list(map(c.__getitem__, rows)) for c in (
+            self.ids, self.nome, self.prov, self.lat, self.lon,
+            self.livello_benzina, self.livello_diesel, self.prezzo_benzina, self.prezzo_diesel,
+        )]
+        prov = self._prov_values
+        return [
+            {
+                "id": i, "nome": n, "provincia": prov[p], "lat": la, "lon": lo,
+                "livello_carburante": {"benzina": lb, "diesel": ld},
+                "prezzo_benzina": pb, "prezzo_diesel": pd,
+            }
+            for i, n, p, la, lo, lb, ld, pb, pd in zip(*cols)
+        ]
+
+    def to_dict(self, row: int) -> Dict:
+        return self.to_dicts((row,))[0]
+
+STORE = StationStore([
     Distributore(1, "Iperstaroil Milano Nord", "MI", 45.515, 9.205, {"benzina": 12000, "diesel": 15000}, 1.949, 1.829),
     Distributore(2, "Iperstaroil Milano Sud", "MI", 45.405, 9.165, {"benzina": 8000, "diesel": 7000}, 1.939, 1.819),
     Distributore(3, "Iperstaroil Torino Centro", "TO", 45.071, 7.686, {"benzina": 6000, "diesel": 5000}, 1.929, 1.809),
     Distributore(4, "Iperstaroil Roma Est", "RM", 41.909, 12.62, {"benzina": 14000, "diesel": 11000}, 1.919, 1.799),
     Distributore(5, "Iperstaroil Napoli Ovest", "NA", 40.851, 14.268, {"benzina": 3000, "diesel": 2500}, 1.959, 1.839),
     Distributore(6, "Iperstaroil Bologna Fiera", "BO", 44.512, 11.36, {"benzina": 9000, "diesel": 10500}, 1.925, 1.805),
-]
-
-def sort_by_id(dis1: Distributore, dis2: Distributore) -> int:
-    return (dis1.id > dis2.id) - (dis1.id < dis2.id)
-
-def find_by_id(did: int) -> Optional[Distributore]:
-    return next((d for d in DISTRIBUTORI if d.id == did), None)
-
-def same_prov(a: str, b: str) -> bool:
-    return a.strip().lower() == b.strip().lower()
+])
 
-def get_by_provincia(provincia: str) -> List[Distributore]:
-    return [d for d in DISTRIBUTORI if same_prov(d.provincia, provincia) or same_prov(full_province_name(d.provincia), provincia) or same_prov(d.provincia, full_province_name(provincia))]
+def find_by_id(did: int) -> Optional[Dict]:
+    row = STORE.row_of(did)
+    return STORE.to_dict(row) if row is not None else None
 
-PROV_FULL = {
-    "MI": "Milano",
-    "TO": "Torino",
-    "RM": "Roma",
-    "NA": "Napoli",
-    "BO": "Bologna",
-}
 def full_province_name(code_or_name: str) -> str:
-    code = code_or_name.strip().upper()
-    if code in PROV_FULL:
-        return PROV_FULL[code]
-    for k, v in PROV_FULL.items():
-        if v.strip().upper() == code:
-            return v
-    return code_or_name
+    return province_name(code_or_name)
 
 @app.get("/api/distributori")
 def api_distributori():
-    ordered = sorted(DISTRIBUTORI, key=cmp_to_key(sort_by_id))
-    return jsonify([d.to_dict() for d in ordered])
+    return jsonify(STORE.to_dicts(STORE.ordered_rows()))
 
 @app.get("/api/distributori/provincia/<provincia>")
 def api_livelli_provincia(provincia: str):
-    matches = get_by_provincia(provincia)
-    if not matches:
+    rows = STORE.rows_in(provincia)
+    if not rows:
         return jsonify({"provincia": provincia, "distributori": [], "totali_litri": {"benzina": 0.0, "diesel": 0.0}})
-    tot_b = sum(d.livello_carburante["benzina"] for d in matches)
-    tot_d = sum(d.livello_carburante["diesel"] for d in matches)
     return jsonify({
         "provincia": provincia,
         "distributori": [
             {
-                "id": d.id,
-                "nome": d.nome,
-                "provincia": d.provincia,
-                "livello_carburante": d.livello_carburante,
-                "prezzi": {"benzina": d.prezzo_benzina, "diesel": d.prezzo_diesel},
-            } for d in matches
+                "id": d["id"],
+                "nome": d["nome"],
+                "provincia": d["provincia"],
+                "livello_carburante": d["livello_carburante"],
+                "prezzi": {"benzina": d["prezzo_benzina"], "diesel": d["prezzo_diesel"]},
+            } for d in STORE.to_dicts(rows)
         ],
-        "totali_litri": {"benzina": tot_b, "diesel": tot_d},
+        "totali_litri": STORE.totals(rows),
     })
 
 @app.get("/api/distributori/<int:did>")
@@ -103,22 +185,22 @@ def api_distributore_singolo(did: int):
     d = find_by_id(did)
     if not d:
         abort(404, description="Distributore non trovato")
-    return jsonify(d.to_dict())
+    return jsonify(d)
 
 @app.get("/api/distributori/geo")
 def api_distributori_geo():
     features = []
-    for d in DISTRIBUTORI:
+    for d in STORE.to_dicts(range(len(STORE))):
         features.append({
             "type": "Feature",
             "properties": {
-                "id": d.id,
-                "nome": d.nome,
-                "provincia": d.provincia,
-                "prezzi": {"benzina": d.prezzo_benzina, "diesel": d.prezzo_diesel},
-                "livello_carburante": d.livello_carburante,
+                "id": d["id"],
+                "nome": d["nome"],
+                "provincia": d["provincia"],
+                "prezzi": {"benzina": d["prezzo_benzina"], "diesel": d["prezzo_diesel"]},
+                "livello_carburante": d["livello_carburante"],
             },
-            "geometry": {"type": "Point", "coordinates": [d.lon, d.lat]},
+            "geometry": {"type": "Point", "coordinates": [d["lon"], d["lat"]]},
         })
     return jsonify({"type": "FeatureCollection", "features": features})
 
@@ -131,18 +213,23 @@ def api_cambia_prezzi_provincia(provincia: str):
     if benz is None and dies is None:
         abort(400, description="Specificare almeno uno tra 'benzina' o 'diesel'")
 
-    matches = get_by_provincia(provincia)
-    if not matches:
+    rows = STORE.rows_in(provincia)
+    if not rows:
         abort(404, description="Nessun distributore trovato per la provincia indicata")
 
-    updated = []
     try:
-        for d in matches:
-            d.set_prezzo(benzina=benz, diesel=dies)
-            updated.append({"id": d.id, "prezzo_benzina": d.prezzo_benzina, "prezzo_diesel": d.prezzo_diesel})
-    except ValueError as e:
+        STORE.set_prezzi(rows, benzina=benz, diesel=dies)
+    except (TypeError, ValueError) as e:
         abort(400, description=str(e))
 
+    updated = [
+        {"id": i, "prezzo_benzina": pb, "prezzo_diesel": pd}
+        for i, pb, pd in zip(
+            map(STORE.ids.__getitem__, rows),
+            map(STORE.prezzo_benzina.__getitem__, rows),
+            map(STORE.prezzo_diesel.__getitem__, rows),
+        )
+    ]
     return jsonify({"provincia": provincia, "aggiornati": len(updated), "dettaglio": updated})
 
 @app.get("/")
@@ -154,6 +241,8 @@ def dettaglio(did: int):
     d = find_by_id(did)
     if not d:
         abort(404)
+    # The template formats litres with thousands separators: whole litres as ints.
+    d["livello_carburante"] = {k: int(v) if v.is_integer() else v for k, v in d["livello_carburante"].items()}
     return render_template("dettaglio.html", d=d)
 
 @app.get("/mappa")
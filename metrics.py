@@ -0,0 +1,370 @@
+import os, time, random, bisect, cProfile, pstats, threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Per-process registry in Prometheus text format; with several gunicorn
+# workers each one reports its own numbers (the pid is in every sample's
+# labels so scrapes through a load balancer stay distinguishable).
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Opt-in sampling profiler: fraction of requests run under cProfile, dumped
+# to PROFILE_DIR (or handed to profile_hook if set).
+PROFILE_SAMPLE = float(os.environ.get("PROFILE_SAMPLE", "0"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profili")
+
+profile_hook: Optional[Callable[[str, pstats.Stats], None]] = None
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._collectors: List[Tuple[str, Callable[[], Dict]]] = []
+
+    def describe(self, name: str, kind: str, text: str):
+        self._help[name] = (kind, text)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = Histogram()
+            h.observe(value)
+
+    def collector(self, prefix: str, fn: Callable[[], Dict]):
+        # fn returns a flat dict of numbers (e.g. a module's stats), exported
+        # as gauges named <prefix>_<key>.
+        self._collectors.append((prefix, fn))
+
+    def render(self) -> str:
+        pid = str(os.getpid())
+        out: List[str] = []
+        seen = set()
+
+        def header(name: str, kind: str):
+            if name in seen:
+                return
+            seen.add(name)
+            help_kind, text = self._help.get(name, (kind, ""))
+            if text:
+                out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {help_kind}")
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, (list(h.counts), h.sum, h.count)) for k, h in self._histograms.items())
+        for (name, labels), value in counters:
+            header(name, "counter")
+            out.append(f"{name}{_labels(labels, pid)} {_num(value)}")
+        for (name, labels), (counts, total, count) in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append(f"{name}_bucket{_labels(labels + (('le', le),), pid)} {cumulative}")
+            out.append(f"{name}_sum{_labels(labels, pid)} {_num(total)}")
+            out.append(f"{name}_count{_labels(labels, pid)} {count}")
+        for prefix, fn in self._collectors:
+            try:
+                stats = fn()
+            except Exception:
+                continue
+            for key, value in sorted(stats.items()):
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                name = f"iperstaroil_{prefix}_{key}"
+                header(name, "gauge")
+                out.append(f"{name}{_labels((), pid)} {_num(value)}")
+        return "\n".join(out) + "\n"
+
+def _labels(labels: Labels, pid: str) -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels] + [f'pid="{pid}"']
+    return "{" + ",".join(parts) + "}"
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _num(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+registry = Registry()
+registry.describe("iperstaroil_http_request_duration_seconds", "histogram", "Latenza delle richieste per endpoint")
+registry.describe("iperstaroil_http_requests_total", "counter", "Richieste per endpoint e stato")
+registry.describe("iperstaroil_firestore_rpc_duration_seconds", "histogram", "Tempo di attesa sulle RPC Firestore")
+registry.describe("iperstaroil_firestore_reads_total", "counter", "Documenti letti da Firestore (letture fatturate)")
+registry.describe("iperstaroil_firestore_writes_total", "counter", "Documenti scritti su Firestore")
+registry.describe("iperstaroil_fase_seconds_total", "counter", "Tempo speso per fase (normalize, json, template)")
+registry.describe("iperstaroil_fase_chiamate_total", "counter", "Chiamate per fase")
+
+# --- per-request timings ----------------------------------------------------
+
+# phase -> [seconds, calls] for the request being served on this context;
+# None outside requests (listener thread, CLI scripts).
+_current: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("metrics_timings", default=None)
+
+def add(phase: str, seconds: float, calls: int = 1):
+    timings = _current.get()
+    if timings is not None:
+        slot = timings.get(phase)
+        if slot is None:
+            timings[phase] = [seconds, calls]
+        else:
+            slot[0] += seconds
+            slot[1] += calls
+
+def phase(name: str, seconds: float):
+    # Phases run per document (normalize) are cheap individually: only the
+    # request's running total is updated here, the global counters once
+    # per request in _finish.
+    add(name, seconds)
+    if _current.get() is None:
+        registry.inc("iperstaroil_fase_seconds_total", seconds, fase=name)
+        registry.inc("iperstaroil_fase_chiamate_total", 1, fase=name)
+
+@contextmanager
+def timed(name: str):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase(name, time.perf_counter() - t)
+
+# --- Firestore --------------------------------------------------------------
+
+def rpc(op: str, seconds: float, reads: int = 0, writes: int = 0):
+    add("firestore", seconds)
+    registry.observe("iperstaroil_firestore_rpc_duration_seconds", seconds, op=op)
+    if reads:
+        registry.inc("iperstaroil_firestore_reads_total", reads, op=op)
+    if writes:
+        registry.inc("iperstaroil_firestore_writes_total", writes, op=op)
+
+def reads(op: str, n: int):
+    if n:
+        registry.inc("iperstaroil_firestore_reads_total", n, op=op)
+
+def stream(op: str, docs: Iterable) -> Iterator:
+    # Wraps a query stream: times only the waits on Firestore (not the
+    # caller's work between documents) and counts documents read; an empty
+    # result still bills one read.
+    it = iter(docs)
+    n, spent = 0, 0.0
+    try:
+        while True:
+            t = time.perf_counter()
+            try:
+                doc = next(it)
+            except StopIteration:
+                spent += time.perf_counter() - t
+                return
+            spent += time.perf_counter() - t
+            n += 1
+            yield doc
+    finally:
+        rpc(op, spent, reads=max(n, 1))
+
+async def astream(op: str, docs: AsyncIterable) -> AsyncIterator:
+    # stream() for AsyncClient queries. The waits also cover other tasks
+    # run by the loop meanwhile: it is the latency this request sees.
+    it = docs.__aiter__()
+    n, spent = 0, 0.0
+    try:
+        while True:
+            t = time.perf_counter()
+            try:
+                doc = await it.__anext__()
+            except StopAsyncIteration:
+                spent += time.perf_counter() - t
+                return
+            spent += time.perf_counter() - t
+            n += 1
+            yield doc
+    finally:
+        rpc(op, spent, reads=max(n, 1))
+
+# --- Flask / Quart integration ----------------------------------------------
+
+def init_app(app):
+    from flask import g, request, before_render_template, template_rendered
+    from flask.json.provider import DefaultJSONProvider
+
+    app.json = _timed_provider(DefaultJSONProvider)(app)
+
+    @app.before_request
+    def _start():
+        _begin(g, profile=True)
+
+    @app.after_request
+    def _finish(resp):
+        return _end(g, request, resp)
+
+    @app.teardown_request
+    def _reset(exc=None):
+        _release(g)
+
+    def _render_start(sender, template, context, **extra):
+        g._metrics_tpl = time.perf_counter()
+
+    def _render_done(sender, template, context, **extra):
+        _template_done(g)
+
+    before_render_template.connect(_render_start, app, weak=False)
+    template_rendered.connect(_render_done, app, weak=False)
+
+def init_quart_app(app):
+    # Same timings for app_async. Hooks and receivers are coroutines: Quart
+    # runs sync ones in a thread, where the ContextVar set would be lost.
+    # No profiler: cProfile on the loop thread would mix in every other
+    # request in flight.
+    from quart import g, request
+    from quart.signals import before_render_template, template_rendered
+    from quart.json.provider import DefaultJSONProvider
+
+    app.json = _timed_provider(DefaultJSONProvider)(app)
+
+    @app.before_request
+    async def _start():
+        _begin(g, profile=False)
+
+    @app.after_request
+    async def _finish(resp):
+        return _end(g, request, resp)
+
+    @app.teardown_request
+    async def _reset(exc=None):
+        _release(g)
+
+    async def _render_start(sender, template, context, **extra):
+        g._metrics_tpl = time.perf_counter()
+
+    async def _render_done(sender, template, context, **extra):
+        _template_done(g)
+
+    before_render_template.connect(_render_start, app, weak=False)
+    template_rendered.connect(_render_done, app, weak=False)
+
+def _timed_provider(base):
+    class TimedJSONProvider(base):
+        def dumps(self, obj, **kwargs):
+            with timed("json"):
+                return super().dumps(obj, **kwargs)
+    return TimedJSONProvider
+
+def _begin(g, profile: bool):
+    g._metrics_token = _current.set({})
+    g._metrics_t0 = time.perf_counter()
+    g._metrics_profile = None
+    if profile and PROFILE_SAMPLE > 0 and random.random() < PROFILE_SAMPLE:
+        g._metrics_profile = cProfile.Profile()
+        g._metrics_profile.enable()
+
+def _end(g, request, resp):
+    t0 = g.pop("_metrics_t0", None)
+    if t0 is None:
+        return resp
+    endpoint = request.url_rule.rule if request.url_rule is not None else "non_trovato"
+    prof = g.pop("_metrics_profile", None)
+    if prof is not None:
+        prof.disable()
+        _dump_profile(endpoint, prof)
+    timings = _current.get()
+    if timings is None:
+        timings = {}
+    labels = {"endpoint": endpoint, "metodo": request.method, "stato": str(resp.status_code)}
+    # A streamed body (the /api/distributori fallback) does its work after
+    # this hook: it is timed, with its Firestore waits, until the response
+    # closes. The header, sent first, only covers the time up to it. Event
+    # streams never end and keep the time to the first byte.
+    if getattr(resp, "is_streamed", False) and resp.mimetype != "text/event-stream":
+        resp.response = _timed_body(resp.response, timings)
+        resp.call_on_close(lambda: _record(labels, time.perf_counter() - t0, timings))
+        resp.headers["Server-Timing"] = _server_timing(timings, time.perf_counter() - t0) + ';desc="stream"'
+        return resp
+    total = time.perf_counter() - t0
+    _record(labels, total, timings)
+    resp.headers["Server-Timing"] = _server_timing(timings, total)
+    return resp
+
+def _timed_body(body: Iterable, timings: Dict[str, List[float]]) -> Iterator:
+    # Runs each step of the body with the request's timings current (the
+    # request context is gone by then).
+    it = iter(body)
+    try:
+        while True:
+            token = _current.set(timings)
+            try:
+                chunk = next(it)
+            except StopIteration:
+                return
+            finally:
+                _current.reset(token)
+            yield chunk
+    finally:
+        close = getattr(body, "close", None)
+        if close is not None:
+            close()
+
+def _record(labels: Dict[str, str], total: float, timings: Dict[str, List[float]]):
+    registry.observe("iperstaroil_http_request_duration_seconds", total, endpoint=labels["endpoint"], metodo=labels["metodo"])
+    registry.inc("iperstaroil_http_requests_total", **labels)
+    for name, (seconds, calls) in timings.items():
+        if name != "firestore":
+            registry.inc("iperstaroil_fase_seconds_total", seconds, fase=name)
+            registry.inc("iperstaroil_fase_chiamate_total", calls, fase=name)
+
+def _server_timing(timings: Dict[str, List[float]], total: float) -> str:
+    parts = []
+    for name, (seconds, calls) in timings.items():
+        desc = f';desc="{int(calls)} rpc"' if name == "firestore" else ""
+        parts.append(f"{name};dur={seconds * 1000:.2f}{desc}")
+    parts.append(f"app;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+def _release(g):
+    token = g.pop("_metrics_token", None)
+    if token is not None:
+        _current.reset(token)
+
+def _template_done(g):
+    t = g.pop("_metrics_tpl", None)
+    if t is not None:
+        phase("template", time.perf_counter() - t)
+
+def _dump_profile(endpoint: str, prof: cProfile.Profile):
+    stats = pstats.Stats(prof)
+    if profile_hook is not None:
+        profile_hook(endpoint, stats)
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = endpoint.strip("/").replace("/", "_").replace("<", "").replace(">", "") or "root"
+    stats.dump_stats(os.path.join(PROFILE_DIR, f"{name}-{os.getpid()}-{time.time_ns()}.prof"))
+
+def render() -> str:
+    return registry.render()
@@ -0,0 +1,64 @@
+import re, unicodedata
+from typing import Dict
+
+# Sigla -> nome for every Italian province / metropolitan city.
+PROVINCE: Dict[str, str] = {
+    "AG": "Agrigento", "AL": "Alessandria", "AN": "Ancona", "AO": "Aosta",
+    "AP": "Ascoli Piceno", "AQ": "L'Aquila", "AR": "Arezzo", "AT": "Asti",
+    "AV": "Avellino", "BA": "Bari", "BG": "Bergamo", "BI": "Biella",
+    "BL": "Belluno", "BN": "Benevento", "BO": "Bologna", "BR": "Brindisi",
+    "BS": "Brescia", "BT": "Barletta-Andria-Trani", "BZ": "Bolzano", "CA": "Cagliari",
+    "CB": "Campobasso", "CE": "Caserta", "CH": "Chieti", "CL": "Caltanissetta",
+    "CN": "Cuneo", "CO": "Como", "CR": "Cremona", "CS": "Cosenza",
+    "CT": "Catania", "CZ": "Catanzaro", "EN": "Enna", "FC": "Forlì-Cesena",
+    "FE": "Ferrara", "FG": "Foggia", "FI": "Firenze", "FM": "Fermo",
+    "FR": "Frosinone", "GE": "Genova", "GO": "Gorizia", "GR": "Grosseto",
+    "IM": "Imperia", "IS": "Isernia", "KR": "Crotone", "LC": "Lecco",
+    "LE": "Lecce", "LI": "Livorno", "LO": "Lodi", "LT": "Latina",
+    "LU": "Lucca", "MB": "Monza e della Brianza", "MC": "Macerata", "ME": "Messina",
+    "MI": "Milano", "MN": "Mantova", "MO": "Modena", "MS": "Massa-Carrara",
+    "MT": "Matera", "NA": "Napoli", "NO": "Novara", "NU": "Nuoro",
+    "OR": "Oristano", "PA": "Palermo", "PC": "Piacenza", "PD": "Padova",
+    "PE": "Pescara", "PG": "Perugia", "PI": "Pisa", "PN": "Pordenone",
+    "PO": "Prato", "PR": "Parma", "PT": "Pistoia", "PU": "Pesaro e Urbino",
+    "PV": "Pavia", "PZ": "Potenza", "RA": "Ravenna", "RC": "Reggio Calabria",
+    "RE": "Reggio Emilia", "RG": "Ragusa", "RI": "Rieti", "RM": "Roma",
+    "RN": "Rimini", "RO": "Rovigo", "SA": "Salerno", "SI": "Siena",
+    "SO": "Sondrio", "SP": "La Spezia", "SR": "Siracusa", "SS": "Sassari",
+    "SU": "Sud Sardegna", "SV": "Savona", "TA": "Taranto", "TE": "Teramo",
+    "TN": "Trento", "TO": "Torino", "TP": "Trapani", "TR": "Terni",
+    "TS": "Trieste", "TV": "Treviso", "UD": "Udine", "VA": "Varese",
+    "VB": "Verbano-Cusio-Ossola", "VC": "Vercelli", "VE": "Venezia", "VI": "Vicenza",
+    "VR": "Verona", "VT": "Viterbo", "VV": "Vibo Valentia",
+}
+
+# Alternative spellings and pre-2016 Sardinian sigle still found in feeds.
+_ALIASES = {
+    "AOSTE": "AO", "VALLE D AOSTA": "AO",
+    "BOZEN": "BZ", "BOLZANO BOZEN": "BZ", "ALTO ADIGE": "BZ",
+    "REGGIO NELL EMILIA": "RE", "REGGIO DI CALABRIA": "RC",
+    "MONZA": "MB", "MONZA BRIANZA": "MB", "MONZA E BRIANZA": "MB",
+    "PESARO URBINO": "PU", "MASSA CARRARA": "MS", "FORLI CESENA": "FC",
+    "BARLETTA ANDRIA TRANI": "BT", "VERBANIA": "VB", "AQUILA": "AQ",
+    "SPEZIA": "SP", "ROMA CAPITALE": "RM",
+    "CI": "SU", "CARBONIA IGLESIAS": "SU", "VS": "SU", "MEDIO CAMPIDANO": "SU",
+    "OG": "NU", "OGLIASTRA": "NU", "OT": "SS", "OLBIA TEMPIO": "SS",
+}
+
+def _fold(value: str) -> str:
+    v = unicodedata.normalize("NFKD", value or "")
+    v = "".join(c for c in v if not unicodedata.combining(c))
+    return re.sub(r"[^A-Z0-9]+", " ", v.upper()).strip()
+
+_LOOKUP: Dict[str, str] = {code: code for code in PROVINCE}
+_LOOKUP.update({_fold(name): code for code, name in PROVINCE.items()})
+_LOOKUP.update(_ALIASES)
+
+# Canonical key for a province code or name: the sigla when known,
+# otherwise the folded text so unknown values still group together.
+def province_key(value: str) -> str:
+    folded = _fold(value)
+    return _LOOKUP.get(folded, folded)
+
+def province_name(value: str) -> str:
+    return PROVINCE.get(province_key(value), value)
@@ -0,0 +1,123 @@
+import gzip, hashlib, threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+from flask import Response, current_app, request
+
+from firestore_layer import collection_version
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+MAX_ENTRIES = 512
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+class _Entry:
+    __slots__ = ("version", "etag", "body", "mimetype", "variants")
+
+    def __init__(self, version: Optional[int], body: bytes, mimetype: str = "application/json"):
+        self.version = version
+        self.body = body
+        self.mimetype = mimetype
+        digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+        self.etag = f"{version:x}-{digest}" if version is not None else digest
+        self.variants: Dict[str, bytes] = {}
+
+    def encoded(self, encoding: str) -> bytes:
+        # Compressed once per entry, then reused by every request.
+        data = self.variants.get(encoding)
+        if data is None:
+            if encoding == "br":
+                data = brotli.compress(self.body, quality=BROTLI_QUALITY)
+            else:
+                data = gzip.compress(self.body, compresslevel=GZIP_LEVEL)
+            self.variants[encoding] = data
+        return data
+
+class ResponseCache:
+    # Encoded JSON bodies keyed by endpoint+params. An entry is valid only
+    # for the collection version it was built at, so any write moving the
+    # version forward invalidates everything without explicit purges.
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0}
+
+    def get(self, key: str, version: int) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+
+    def put(self, key: str, entry: _Entry) -> _Entry:
+        with self._lock:
+            self.stats["misses"] += 1
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+cache = ResponseCache()
+
+def _encode(payload) -> bytes:
+    return current_app.json.dumps(payload, separators=(",", ":")).encode("utf-8") + b"\n"
+
+def _pick_encoding() -> Optional[str]:
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+def cached_json(key: str, build: Callable[[], object], fallback: Optional[Callable[[], Response]] = None) -> Response:
+    # fallback, if given, produces the response when there is no collection
+    # version to cache against (replica not serving).
+    version = collection_version()
+    if version is None and fallback is not None:
+        return fallback()
+    return _cached(key, version, lambda: _encode(build()), "application/json")
+
+def cached_body(key: str, build: Callable[[], bytes], mimetype: str) -> Response:
+    # Like cached_json for an already encoded body (binary exports).
+    return _cached(key, collection_version(), build, mimetype)
+
+def _cached(key: str, version: Optional[int], build: Callable[[], bytes], mimetype: str) -> Response:
+    entry = cache.get(key, version) if version is not None else None
+    if entry is None:
+        entry = _Entry(version, build(), mimetype)
+        if version is not None:
+            cache.put(key, entry)
+    return respond(entry)
+
+# Strong ETags must differ per content-coding, or a cache revalidating the
+# gzip body could be handed the identity bytes after a 304.
+_ETAG_SUFFIX = {"br": "-br", "gzip": "-gz"}
+
+def respond(entry: _Entry) -> Response:
+    encoding = _pick_encoding()
+    etag = entry.etag + _ETAG_SUFFIX.get(encoding, "")
+    if request.if_none_match.contains(etag):
+        cache.stats["not_modified"] += 1
+        resp = Response(status=304)
+    else:
+        body = entry.encoded(encoding) if encoding else entry.body
+        resp = Response(body, mimetype=entry.mimetype)
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+    resp.set_etag(etag)
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
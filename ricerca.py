@@ -0,0 +1,112 @@
+import heapq
+from itertools import islice, takewhile
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from aggregati import FUELS, ProvinceAggregates
+from geo_index import GridIndex, haversine_km
+from province import province_key
+
+ORDINAMENTI = ("prezzo_benzina", "prezzo_diesel", "distanza")
+
+Risultato = Tuple[Optional[float], Dict]  # (distance km, or None without a position; station)
+
+class Criteri:
+    # Filters and ordering of a /api/distributori/cerca query.
+    __slots__ = ("provincia_key", "livello_min", "prezzo_max", "lat", "lon", "raggio_km", "ordina", "limit")
+
+    def __init__(self, ordina: str, limit: int, provincia_key: Optional[str] = None,
+                 livello_min: Optional[Dict[str, float]] = None, prezzo_max: Optional[Dict[str, float]] = None,
+                 lat: Optional[float] = None, lon: Optional[float] = None, raggio_km: Optional[float] = None):
+        if ordina not in ORDINAMENTI:
+            raise ValueError(f"'ordina' deve essere uno tra {', '.join(ORDINAMENTI)}")
+        if (lat is None) != (lon is None):
+            raise ValueError("Specificare sia 'lat' che 'lon'")
+        if lat is None and (ordina == "distanza" or raggio_km is not None):
+            raise ValueError("'lat' e 'lon' obbligatori per ordinare per distanza o filtrare per raggio")
+        self.ordina = ordina
+        self.limit = limit
+        self.provincia_key = provincia_key
+        self.livello_min = {f: v for f, v in (livello_min or {}).items() if v is not None}
+        self.prezzo_max = {f: v for f, v in (prezzo_max or {}).items() if v is not None}
+        self.lat, self.lon, self.raggio_km = lat, lon, raggio_km
+
+    def accetta(self, d: Dict) -> bool:
+        if self.provincia_key is not None and d["provincia_key"] != self.provincia_key:
+            return False
+        for f, v in self.livello_min.items():
+            if d["livello_carburante"][f] < v:
+                return False
+        for f, v in self.prezzo_max.items():
+            if d["prezzo_" + f] > v:
+                return False
+        return True
+
+    def distanza(self, d: Dict) -> Optional[float]:
+        if self.lat is None:
+            return None
+        return haversine_km(self.lat, self.lon, d["lat"], d["lon"])
+
+def parse_criteri(args, default_limit: int, max_limit: int) -> Criteri:
+    # Query string of /api/distributori/cerca:
+    #   ?provincia=&ordina=prezzo_benzina|prezzo_diesel|distanza&limit=
+    #   &livello_min_<fuel>=&prezzo_max_<fuel>=&lat=&lon=&raggio_km=
+    lat = args.get("lat", type=float)
+    lon = args.get("lon", type=float)
+    raggio = args.get("raggio_km", type=float)
+    limit = args.get("limit", default_limit, type=int)
+    if lat is not None and lon is not None and not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("Parametri 'lat' e 'lon' non validi")
+    if raggio is not None and raggio <= 0:
+        raise ValueError("'raggio_km' deve essere > 0")
+    if not (0 < limit <= max_limit):
+        raise ValueError(f"'limit' deve essere tra 1 e {max_limit}")
+    provincia = args.get("provincia")
+    return Criteri(
+        ordina=args.get("ordina") or ("distanza" if lat is not None else "prezzo_benzina"),
+        limit=limit,
+        provincia_key=province_key(provincia) if provincia else None,
+        livello_min={f: args.get(f"livello_min_{f}", type=float) for f in FUELS},
+        prezzo_max={f: args.get(f"prezzo_max_{f}", type=float) for f in FUELS},
+        lat=lat, lon=lon, raggio_km=raggio,
+    )
+
+def _primi(c: Criteri, scored: Iterable[Risultato]) -> List[Risultato]:
+    # scored arrives already in result order: stop at the limit-th match.
+    return list(islice(((dist, d) for dist, d in scored if c.accetta(d)), c.limit))
+
+def cerca_indici(c: Criteri, docs: Dict[int, Dict], agg: ProvinceAggregates, geo: GridIndex,
+                 by_prov: Dict[str, Set[int]]) -> List[Risultato]:
+    # Top-k over the replica's indexes. Candidates are walked in result
+    # order (per-fuel price lists, or rings of the grid for distance), so
+    # the work is proportional to how many stations precede the k-th match
+    # rather than to the network size.
+    if c.raggio_km is not None:
+        # Usually far fewer stations in the circle than in the price lists.
+        hits = ((dist, docs[did]) for dist, did in geo.within(c.lat, c.lon, c.raggio_km))
+        return _ordina(c, hits)
+    if c.ordina == "distanza":
+        if c.provincia_key is not None:
+            return _ordina(c, ((c.distanza(docs[i]), docs[i]) for i in by_prov.get(c.provincia_key, ())))
+        return _primi(c, ((dist, docs[did]) for dist, did in geo.iter_nearest(c.lat, c.lon)))
+    fuel = c.ordina[len("prezzo_"):]
+    keys = [c.provincia_key] if c.provincia_key is not None else agg.keys()
+    order: Iterator[Tuple[float, int]] = heapq.merge(*(agg.price_order(k, fuel) for k in keys))
+    ceiling = c.prezzo_max.get(fuel)
+    if ceiling is not None:
+        # Lists are price-sorted: nothing past the ceiling can match.
+        order = takewhile(lambda e: e[0] <= ceiling, order)
+    return _primi(c, ((c.distanza(docs[did]), docs[did]) for _, did in order))
+
+def cerca_lista(c: Criteri, docs: Iterable[Dict]) -> List[Risultato]:
+    # Same query over a plain list of stations (replica not serving).
+    scored = ((c.distanza(d), d) for d in docs)
+    if c.raggio_km is not None:
+        scored = (s for s in scored if s[0] <= c.raggio_km)
+    return _ordina(c, scored)
+
+def _ordina(c: Criteri, scored: Iterable[Risultato]) -> List[Risultato]:
+    matches = ((dist, d) for dist, d in scored if c.accetta(d))
+    if c.ordina == "distanza":
+        return heapq.nsmallest(c.limit, matches, key=lambda s: (s[0], s[1]["id"]))
+    field = c.ordina
+    return heapq.nsmallest(c.limit, matches, key=lambda s: (s[1][field], s[1]["id"]))
@@ -0,0 +1,163 @@
+import os, json, time, atexit, threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from aggregati import FUELS
+from firestore_layer import BULK_WORKERS, bulk_write, existing_ids
+
+# Distinct stations that may wait in the buffer; beyond that new readings
+# are refused until the next flush (backpressure).
+TELEMETRIA_MAX_PENDING = int(os.environ.get("TELEMETRIA_MAX_PENDING", "20000"))
+TELEMETRIA_FLUSH_S = float(os.environ.get("TELEMETRIA_FLUSH_S", "2.0"))
+
+class BufferPieno(Exception):
+    pass
+
+class LevelBuffer:
+    # Coalesces tank-level readings per station and fuel (newest timestamp
+    # wins) and writes them out in periodic bulk writes, so a station
+    # reporting every second costs one Firestore write per flush interval.
+
+    def __init__(self, max_pending: int = TELEMETRIA_MAX_PENDING, flush_interval: float = TELEMETRIA_FLUSH_S):
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Dict[str, Tuple[float, float]]] = {}
+        self._written: Dict[Tuple[int, str], float] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._wake = threading.Event()
+        self.stats = {"ricevute": 0, "coalescenti": 0, "rifiutate": 0, "scritte": 0, "errori": 0, "flush": 0}
+
+    def _ensure_flusher(self):
+        # Started lazily (and again after a fork) so every worker process
+        # owns its own flush thread.
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="telemetria-flush", daemon=True)
+        self._thread.start()
+
+    def offer(self, readings: Iterable[Tuple[int, str, float, float]]) -> int:
+        # readings: (station id, fuel, litres, timestamp). All-or-nothing:
+        # raises BufferPieno without queuing anything if the batch would
+        # grow the buffer past max_pending.
+        readings = list(readings)
+        with self._lock:
+            self._ensure_flusher()
+            new_ids = {r[0] for r in readings} - self._pending.keys()
+            if len(self._pending) + len(new_ids) > self.max_pending:
+                self.stats["rifiutate"] += len(readings)
+                self._wake.set()
+                raise BufferPieno()
+            for did, fuel, litri, ts in readings:
+                self.stats["ricevute"] += 1
+                if ts < self._written.get((did, fuel), float("-inf")):
+                    continue
+                slot = self._pending.setdefault(did, {})
+                prev = slot.get(fuel)
+                if prev is not None:
+                    self.stats["coalescenti"] += 1
+                    if prev[0] > ts:
+                        continue
+                slot[fuel] = (ts, litri)
+            return len(readings)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def flush(self, workers: int = BULK_WORKERS) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        writes = {
+            did: {f"livello_carburante.{fuel}": litri for fuel, (_, litri) in fuels.items()}
+            for did, fuels in batch.items()
+        }
+        try:
+            results = bulk_write(writes, workers=workers)
+        except Exception:
+            # Nothing is known to be written: keep the whole batch for the
+            # next flush.
+            with self._lock:
+                self.stats["errori"] += len(batch)
+                for did, fuels in batch.items():
+                    self._restore(did, fuels)
+            raise
+        with self._lock:
+            self.stats["flush"] += 1
+            for did, err in results.items():
+                if err is None:
+                    self.stats["scritte"] += 1
+                    for fuel, (ts, _) in batch[did].items():
+                        self._written[(did, fuel)] = ts
+                    continue
+                self.stats["errori"] += 1
+                if not err.startswith("NotFound"):
+                    self._restore(did, batch[did])
+        return len(results)
+
+    def _restore(self, did: int, fuels: Dict[str, Tuple[float, float]]):
+        # Transient failure: put the readings back unless newer ones arrived
+        # in the meantime. Caller holds the lock.
+        slot = self._pending.setdefault(did, {})
+        for fuel, reading in fuels.items():
+            if fuel not in slot or slot[fuel][0] < reading[0]:
+                slot[fuel] = reading
+
+buffer = LevelBuffer()
+# Serial: by the time atexit hooks run, thread pools refuse new work.
+# gunicorn workers flush earlier, from worker_exit (gunicorn.conf.py).
+atexit.register(buffer.flush, workers=1)
+
+def parse_reading(raw: Dict, now: Optional[float] = None) -> List[Tuple[int, str, float, float]]:
+    # {"id": 1, "benzina": 1200.5, "diesel": 800, "ts": 1700000000.0}
+    did = int(raw["id"])
+    ts = float(raw.get("ts") or (now if now is not None else time.time()))
+    out = []
+    for fuel in FUELS:
+        if raw.get(fuel) is None:
+            continue
+        litri = float(raw[fuel])
+        if litri < 0:
+            raise ValueError(f"Livello {fuel} negativo")
+        out.append((did, fuel, litri, ts))
+    if not out:
+        raise ValueError("Nessun livello nella lettura")
+    return out
+
+def parse_ndjson(lines: Iterable) -> Iterator[Dict]:
+    # One reading per line; a line that isn't JSON yields {} and is counted
+    # as scartata by ingest.
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield {}
+
+def ingest(raws: Iterable[Dict]) -> Dict:
+    now = time.time()
+    records, scartate = [], 0
+    for raw in raws:
+        try:
+            records.append(parse_reading(raw, now))
+        except (KeyError, TypeError, ValueError):
+            scartate += 1
+    known = existing_ids(list({r[0][0] for r in records}), remote=False)
+    if known is not None:
+        scartate += sum(1 for r in records if r[0][0] not in known)
+        records = [r for r in records if r[0][0] in known]
+    buffer.offer(reading for r in records for reading in r)
+    return {"accettate": len(records), "scartate": scartate, "in_coda": buffer.pending()}
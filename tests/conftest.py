@@ -0,0 +1,11 @@
+import pytest
+
+from bench.fakefirestore import FakeFirestore
+import firebase_client
+
+@pytest.fixture
+def db():
+    fake = FakeFirestore()
+    firebase_client.set_db(fake)
+    yield fake
+    firebase_client.set_db(None)
@@ -0,0 +1,11 @@
+# Station documents for the tests, in the collection's stored shape.
+
+def stazione(did: int, provincia: str = "MI", lat: float = 45.46, lon: float = 9.19, **extra):
+    d = {
+        "id": did, "nome": f"Distributore {did}", "provincia": provincia,
+        "lat": lat, "lon": lon,
+        "livello_carburante": {"benzina": 1000.0, "diesel": 500.0},
+        "prezzo_benzina": 1.9, "prezzo_diesel": 1.8,
+    }
+    d.update(extra)
+    return d
@@ -0,0 +1,63 @@
+import pytest
+
+from eventi import Broker, EventiPersi, dopo, event_id, parse_id
+
+def evento(version, did, name="distributore"):
+    return version, name, {"id": did}
+
+def test_parse_id():
+    assert parse_id("1700.42") == (1700, 42)
+    assert parse_id("1700") == (1700, None)
+    assert parse_id("") is None
+    assert parse_id("x.1") is None
+    assert parse_id(event_id(evento(5, 3))) == (5, 3)
+
+def test_dopo_resends_rest_of_commit():
+    assert dopo(evento(5, 2), (5, 1))
+    assert not dopo(evento(5, 1), (5, 1))
+    assert not dopo(evento(5, 2), (5, None))
+    assert dopo(evento(6, 1), (5, 1))
+
+def test_subscribe_before_sync_has_no_history():
+    b = Broker()
+    assert b.subscribe((1, None))[1] is None
+    assert b.subscribe(None)[1] == []
+
+def test_resume_from_last_event_id():
+    b = Broker()
+    b.reset(10)
+    for version, did in [(11, 1), (12, 2), (12, 3), (13, 4)]:
+        b.publish(*evento(version, did))
+    _, backlog = b.subscribe((12, 2))
+    assert [ev[2]["id"] for ev in backlog] == [3, 4]
+    _, backlog = b.subscribe((10, None))
+    assert [ev[2]["id"] for ev in backlog] == [1, 2, 3, 4]
+
+def test_resume_past_evicted_events_needs_full_resync():
+    b = Broker(size=2)
+    b.reset(10)
+    for version in (11, 12, 13):
+        b.publish(*evento(version, version))
+    # Event 11 was evicted: only resumes from after it are still covered.
+    assert b.subscribe((10, None))[1] is None
+    assert b.subscribe((11, 11))[1] is None
+    assert [ev[0] for ev in b.subscribe((11, None))[1]] == [12, 13]
+
+def test_reader_behind_the_ring_is_dropped():
+    b = Broker(size=2)
+    b.reset(0)
+    cursor, _ = b.subscribe(None)
+    for version in (1, 2, 3):
+        b.publish(*evento(version, version))
+    with pytest.raises(EventiPersi):
+        b.read(cursor, 0)
+    assert b.stats["persi"] == 1
+
+def test_read_returns_new_events():
+    b = Broker()
+    b.reset(0)
+    cursor, _ = b.subscribe(None)
+    assert b.read(cursor, 0) == (cursor, [])
+    b.publish(*evento(1, 7))
+    cursor, events = b.read(cursor, 0)
+    assert events == [evento(1, 7)]
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from FirebaseStuff import importer
+import firestore_layer
+from firestore_layer import COLL
+from tests.dati import stazione
+
+class Unavailable(Exception):
+    pass
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(firestore_layer, "BULK_BACKOFF", 0)
+
+def run(capsys, *argv) -> dict:
+    importer.main([str(a) for a in argv])
+    return json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+
+def stored(db):
+    return sorted(int(did) for did in db.collection(COLL)._docs)
+
+def write_csv(path, righe):
+    path.write_text("id,nome,provincia,lat,lon\n" + "".join(f"{r}\n" for r in righe))
+    return path
+
+def test_checkpoint_resume_retries_failed_writes(db, tmp_path, capsys, monkeypatch):
+    src = tmp_path / "stazioni.jsonl"
+    src.write_text("\n".join(json.dumps(stazione(i)) for i in range(1, 7)))
+    ckpt = tmp_path / "import.ckpt"
+    batch = db.batch
+
+    def failing_batch():
+        b = batch()
+        commit = b.commit
+
+        def maybe_fail():
+            if any(ref.id == "3" for _, ref, _ in b._ops):
+                raise Unavailable("station 3 unavailable")
+            return commit()
+        b.commit = maybe_fail
+        return b
+    monkeypatch.setattr(db, "batch", failing_batch)
+    esito = run(capsys, src, "--checkpoint", ckpt, "--batch", 2)
+    assert esito["errori"] >= 1
+    assert 3 in json.loads(ckpt.read_text())["falliti"]
+    assert 3 not in stored(db)
+
+    monkeypatch.setattr(db, "batch", batch)
+    esito = run(capsys, src, "--checkpoint", ckpt, "--batch", 2)
+    assert esito["righe"] == 6
+    assert esito["errori"] == 0
+    assert stored(db) == [1, 2, 3, 4, 5, 6]
+    assert not ckpt.exists()
+
+def test_elimina_mancanti_deletes_absent_stations(db, tmp_path, capsys):
+    db.load(COLL, [stazione(i) for i in (1, 2, 3)])
+    src = write_csv(tmp_path / "stazioni.csv", ["1,A,MI,45.5,9.2", "2,B,MI,45.4,9.1"])
+    esito = run(capsys, src, "--elimina-mancanti")
+    assert esito["eliminati"] == 1
+    assert stored(db) == [1, 2]
+
+def test_elimina_mancanti_keeps_station_whose_row_failed_to_parse(db, tmp_path, capsys):
+    db.load(COLL, [stazione(i) for i in (1, 2, 3)])
+    src = write_csv(tmp_path / "stazioni.csv", ["1,A,MI,45.5,9.2", "2,B,MI,45.4,9.1", "3,C,TO,n.d.,7.6"])
+    esito = run(capsys, src, "--elimina-mancanti")
+    assert esito["scartati"] == 1
+    assert esito["eliminati"] == 0
+    assert stored(db) == [1, 2, 3]
+
+def test_elimina_mancanti_refused_when_a_row_has_no_id(db, tmp_path, capsys):
+    db.load(COLL, [stazione(i) for i in (1, 2, 3)])
+    src = write_csv(tmp_path / "stazioni.csv", ["1,A,MI,45.5,9.2", "xx,B,MI,45.4,9.1"])
+    esito = run(capsys, src, "--elimina-mancanti")
+    assert esito["eliminazione_annullata"]
+    assert stored(db) == [1, 2, 3]
@@ -0,0 +1,82 @@
+import pytest
+
+from eventi import Broker
+import firestore_layer
+from firestore_layer import COLL, _Replica, _ts_us
+from tests.dati import stazione
+
+@pytest.fixture
+def broker(monkeypatch):
+    b = Broker()
+    monkeypatch.setattr(firestore_layer, "broker", b)
+    return b
+
+@pytest.fixture
+def replica(db, broker):
+    db.load(COLL, [
+        stazione(1, "MI", 45.46, 9.19),
+        stazione(2, "MI", 45.50, 9.20),
+        stazione(3, "TO", 45.07, 7.69),
+    ])
+    r = _Replica(max_staleness=60)
+    r._start()
+    yield r
+    r._watch.unsubscribe()
+
+def ids(docs):
+    return [d["id"] for d in docs]
+
+def test_first_snapshot_builds_indexes(replica):
+    assert ids(replica.ordered()) == [1, 2, 3]
+    assert ids(replica.by_provincia("MI")) == [1, 2]
+    assert ids(replica.by_provincia("TO")) == [3]
+    assert [d["id"] for _, d in replica.nearby(45.07, 7.69, k=1, raggio_km=None)] == [3]
+    assert replica.aggregati("MI")["distributori"] == 2
+    assert replica.version > 0
+
+def test_update_moves_station_between_indexes(db, replica):
+    changes = replica.changes
+    db.collection(COLL).document("2").update({"provincia": "TO", "provincia_key": "TO", "lat": 45.06, "lon": 7.68})
+    assert ids(replica.by_provincia("MI")) == [1]
+    assert ids(replica.by_provincia("TO")) == [2, 3]
+    assert [d["id"] for _, d in replica.nearby(45.06, 7.68, k=2, raggio_km=None)] == [2, 3]
+    assert replica.aggregati("MI")["distributori"] == 1
+    assert replica.changes == changes + 1
+
+def test_remove_unindexes_and_shows_in_delta(db, replica, broker):
+    since = replica.version
+    db.collection(COLL).document("1").delete()
+    assert replica.get(1) is None
+    assert ids(replica.by_provincia("MI")) == [2]
+    assert replica.nearby(45.46, 9.19, k=None, raggio_km=1) == []
+    version, full, changed, gone = replica.delta(since)
+    assert (full, changed, gone) == (False, [], [1])
+    assert version > since
+    _, backlog = broker.subscribe((since, None))
+    assert [(name, payload) for _, name, payload in backlog] == [("eliminato", {"id": 1})]
+
+def test_apply_local_waits_for_listener_to_move_version(db, replica, broker):
+    watch = replica._watch
+    held = []
+    deliver, watch.callback = watch.callback, lambda *a: held.append(a)
+    wr = db.collection(COLL).document("1").update({"prezzo_benzina": 1.5})
+    version, changes = replica.version, replica.changes
+
+    replica.apply_local(1, {"prezzo_benzina": 1.5}, wr.update_time)
+    assert replica.get(1)["prezzo_benzina"] == 1.5
+    assert replica.version == version
+    assert replica.changes == changes + 1
+    assert broker.subscribe((version, None))[1] == []
+
+    for args in held:
+        deliver(*args)
+    assert replica.version == _ts_us(wr.update_time)
+    _, backlog = broker.subscribe((version, None))
+    assert [payload for _, _, payload in backlog] == [{"id": 1, "prezzo_benzina": 1.5}]
+
+def test_apply_local_after_listener_is_ignored(db, replica):
+    wr = db.collection(COLL).document("1").update({"prezzo_benzina": 1.5})
+    changes = replica.changes
+    replica.apply_local(1, {"prezzo_benzina": 1.4}, wr.update_time)
+    assert replica.get(1)["prezzo_benzina"] == 1.5
+    assert replica.changes == changes